@@ -3,24 +3,22 @@
 
 
 from geo_functions import *
+import regions
+import cube
+import tiles
 
 import streamlit as st
-import pandas as pd
-import geopandas as gpd
-import numpy as np
-import datetime
 import altair as alt
 import pickle
 from PIL import Image
 
 import streamlit as st
-from streamlit_folium import folium_static
-import folium
+import streamlit.components.v1 as components
 
 ###################################################################
 # load and prepare data
 
-gdf = read_excel_data().set_crs(epsg=4326)
+gdf = read_data().set_crs(epsg=4326, allow_override=True)
 df_v = gdf[gdf['type']== 'Vacant'].copy()
 df_v['year'] = df_v['date'].dt.year
 df_a = gdf[gdf['type']== 'Abandoned'].copy()
@@ -123,95 +121,36 @@ col2.altair_chart(c, use_container_width=True)
 st.subheader(f'Vacant and abandoned buildings are everywhere.')
 
 
-# ###################################################################
-# # Ward Table
+# counts by ward, district, neighborhood, block, year and type are precomputed
+# (see cube.py); Nghbhd, District and WARD2 are stored with each point at ingest
+# (see regions.py), and both steps only redo what is missing or changed; the
+# mirror's records have a cube of their own (see data_store.py)
+counts = cube.build(regions.assign(gdf), gdf.attrs.get('cube_path', cube.CUBE_PATH))
 
-# ward_expander = st.expander(label='How many vacant and abandoned buildings are in my ward?')
-# with ward_expander:
-    
-#     st.header('ADD A SMALL CHLOROPLETH MAP HERE')
-    
-#     ward_map = gpd.read_file('./maps/wards/ward2012.shp')
-#     ward_map = ward_map.to_crs(epsg=4326)
-#     gdf_by_ward=gpd.sjoin(gdf, ward_map, how='left', predicate="within")
-#     gdf_by_ward['year'] = gdf_by_ward['date'].dt.year
-#     result = pd.pivot_table(
-#         gdf_by_ward, 
-#         values='street_address', 
-#         index=['WARD2'],           
-#         columns=['year'], 
-#         aggfunc=np.size
-#     )
-#     result[2019] = ''
-#     result[2020] = ''
-#     result = result.sort_index(axis=1)
-#     st.table(result)
-
-###################################################################
-# Ward Table (alt, using neighborhood map)
-
-# ward_expander = st.expander(label='How many vacant and abandoned buildings are in my ward?')
-# with ward_expander:
+def year_table(level, label, missing):
+    # counts for one geography level by year, with the years we have no list for marked
+    result = cube.table(counts, level).rename_axis(label)
+    result[2019] = missing
+    result[2020] = missing
+    return result.sort_index(axis=1).fillna('')
 
 st.markdown('Every ward has vacant and abandoned buildings throughout. There are vacant and abandoned buildings on almost every block. *Missing data for 2019 and 2020 will be filled in as it is made available by city officials.')
 
-# load shapefile and set crs
-neighborhood_map = gpd.read_file('./maps/neighborhoods/Neighborhoods3.shp')
-neighborhood_map = neighborhood_map.to_crs(epsg=4326)
-
-# spatial join
-gdf_by_neighborhood=gpd.sjoin(gdf, neighborhood_map, how='left', predicate="within")
-
-
-# make pivot table
-table = pd.pivot_table(gdf_by_neighborhood, values='street_address', index=['Nghbhd'],
-                    columns=['date'], aggfunc=np.size)
-# clean up and render
-
-gdf_by_neighborhood['year'] = gdf_by_neighborhood['date'].dt.year
-
-result = pd.pivot_table(gdf_by_neighborhood, values='street_address', index=['District'],
-                    columns=['year'], aggfunc=np.size)
-result[2019] = '*'
-result[2020] = '*'
-result = result.sort_index(axis=1).fillna('')
-
 # TODO format the float to 0 places
 # pd.options.display.float_format = '{:.0f}'.format
-st.table(result)
-
-
-# ###################################################################
-# # Neighborhood Table
-# hood_expander = st.expander(label='How many vacant and abandoned buildings are in my neighborhood?')
-# with hood_expander:
-    
-#     st.header('ADD A SMALL CHLOROPLETH MAP HERE')
-    
-#     # load shapefile and set crs
-#     neighborhood_map = gpd.read_file('./maps/neighborhoods/Neighborhoods3.shp')
-#     neighborhood_map = neighborhood_map.to_crs(epsg=4326)
-
-#     # spatial join
-#     gdf_by_neighborhood=gpd.sjoin(gdf, neighborhood_map, how='left', predicate="within")
-
+st.table(year_table('district', 'District', '*'))
 
-#     # make pivot table
-#     table = pd.pivot_table(gdf_by_neighborhood, values='street_address', index=['Nghbhd'],
-#                         columns=['date'], aggfunc=np.size)
-#     # clean up and render
-
-#     gdf_by_neighborhood['year'] = gdf_by_neighborhood['date'].dt.year
+###################################################################
+# Ward Table
+ward_expander = st.expander(label='How many vacant and abandoned buildings are in my ward?')
+with ward_expander:
+    st.table(year_table('ward', 'WARD2', ''))
 
-#     result = pd.pivot_table(gdf_by_neighborhood, values='street_address', index=['Nghbhd'],
-#                         columns=['year'], aggfunc=np.size)
-#     result[2019] = ''
-#     result[2020] = ''
-#     result = result.sort_index(axis=1).fillna('')
-    
-#     # TODO format the float to 0 places
-#     # pd.options.display.float_format = '{:.0f}'.format
-#     st.table(result)
+###################################################################
+# Neighborhood Table
+hood_expander = st.expander(label='How many vacant and abandoned buildings are in my neighborhood?')
+with hood_expander:
+    st.table(year_table('neighborhood', 'Nghbhd', ''))
 
     
 ###################################################################
@@ -219,63 +158,16 @@ st.table(result)
 # map_expander = st.expander(label='Are there vacant and abandoned buildings on my block?')
 # with map_expander:
 
-# use streamlit-folium
-# https://discuss.streamlit.io/t/ann-streamlit-folium-a-component-for-rendering-folium-maps/4367
-
-# Stamen Toner
-map = folium.Map(
-    location=[40.725,-74.075],
-    tiles='Stamen Toner',
-    zoom_start=13)
-
-# drop all but current year
-gdf = gdf[gdf['date']==datetime.datetime(2021,7,1)]
-
-# Create a geometry list from the GeoDataFrame
-geo_df_list_tmp = [[point.xy[1][0], point.xy[0][0]] for point in gdf.geometry ]
-
-# drop NaNs
-import math
-
-geo_df_list = [t for t in geo_df_list_tmp if not any(isinstance(n, float) and math.isnan(n) for n in t)]
-
-
-# Iterate through list and add a marker for each address, color-coded by its type.
-i = 0
-for coordinates in geo_df_list:
-    #assign a color marker for the type
-    if gdf['type'].iloc[i] == "Abandoned":
-        type_color = "red"
-    elif gdf['type'].iloc[i] == "Vacant":
-        type_color = "orange"
-    else:
-        type_color = "gray"
-
-
-    # alternate symbol
-    # adapted from
-    # https://stackoverflow.com/questions/33575053/change-marker-in-folium-map
-    # and https://stackoverflow.com/questions/63152298/updating-folium-changed-the-popup-box-width
-
-    html = "Address: " + str(gdf.street_address.iloc[i]) + '<br>' + \
-           "Date: " + str(gdf.date.iloc[i]) + '<br>' + \
-           "Status: " + str(gdf['type'].iloc[i])
-    iframe = folium.IFrame(html)
-    popup = folium.Popup(iframe,
-                         min_width=250,
-                         max_width=250)
-
-    map.add_child(folium.CircleMarker(location = coordinates, 
-                                      radius = 5, 
-                                      popup = popup,
-                                      fill_color=type_color,
-                                      color=type_color, 
-                                      fill_opacity=0.7))
-
-    i = i + 1
-
+# the points (and parcels, with the Airtable mirror) are static GeoJSON tiles,
+# re-exported only when the data changes (see tiles.py); the map page just
+# fetches the tiles in view
+layers = tiles.export(gdf)['layers']
+all_years = st.checkbox('Show every year', value=False)
+# drop all but current year unless every year is shown
+shown = [name for name, layer in layers.items()
+         if layer['kind'] == 'parcels' or all_years or layer['year'] == 2021]
 
-folium_static(map)
+components.html(tiles.map_html(shown), width=700, height=500)
 
 
 ###################################################################
@@ -0,0 +1,54 @@
+# Compare load times: the Excel path app.py used vs the parquet store.
+#
+# run from the "2021 study" directory:
+#   python benchmarks/bench_store.py [--repeat N]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data_store
+from geo_functions import read_excel_data
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Excel vs parquet load benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--excel', default=data_store.EXCEL_PATH)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.parquet')
+    data_store.convert(args.excel, path)
+
+    cases = [
+        ('excel (read_excel_data)', lambda: read_excel_data()),
+        ('parquet, all rows', lambda: data_store.load(path=path)),
+        ('parquet, 2021 only', lambda: data_store.load(years=[2021], path=path)),
+        ('parquet, 2021 abandoned', lambda: data_store.load(years=[2021], types=['Abandoned'], path=path)),
+        ('parquet, map columns', lambda: data_store.load(columns=['street_address', 'date', 'type'], path=path)),
+    ]
+    results = []
+    for label, func in cases:
+        elapsed, gdf = timed(func, args.repeat)
+        results.append((label, elapsed, len(gdf)))
+
+    baseline = results[0][1]
+    print(f"{'case':<28}{'rows':>7}{'ms':>10}{'speedup':>9}")
+    for label, elapsed, rows in results:
+        print(f'{label:<28}{rows:>7}{elapsed * 1000:>10.1f}{baseline / elapsed:>8.1f}x')
+    print(f'excel {os.path.getsize(args.excel)} bytes, parquet {os.path.getsize(path)} bytes')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Precomputed counts of the collated lists by geography, snapshot and type.
+#
+# One row per (level, region, date, type) with its year and count, for every
+# geography level in LEVELS. The cube is written next to the data store with a
+# fingerprint of each list snapshot, and build() only re-aggregates snapshots
+# that are new or changed, so the app's tables become lookups via table().
+
+import os
+import json
+import hashlib
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CUBE_PATH = './data/cube.parquet'
+
+# geography level -> column holding the region (None: the whole city)
+LEVELS = {
+    'city': None,
+    'ward': 'WARD2',
+    'district': 'District',
+    'neighborhood': 'Nghbhd',
+    'block': 'block',
+}
+
+FINGERPRINTS_KEY = b'apra.snapshots'
+
+def snapshot_fingerprints(gdf):
+    # {snapshot date: hash of the columns the cube counts}, one per list snapshot
+    columns = ['type'] + [column for column in LEVELS.values() if column and column in gdf.columns]
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(gdf[columns]).astype(str), index=False)
+    fingerprints = {}
+    for date, values in hashes.groupby(gdf['date'].to_numpy()):
+        key = pd.Timestamp(date).strftime('%Y-%m-%d')
+        fingerprints[key] = hashlib.sha1(values.to_numpy().tobytes()).hexdigest()
+    return fingerprints
+
+def aggregate(gdf):
+    # the cube rows for gdf, one groupby per level
+    frames = []
+    for level, column in LEVELS.items():
+        if column is not None and column not in gdf.columns:
+            continue
+        region = pd.Series('Jersey City', index=gdf.index) if column is None else gdf[column].astype(object)
+        counts = pd.DataFrame({'region': region, 'date': gdf['date'], 'type': gdf['type'].astype(object)})
+        counts = counts.dropna().groupby(['region', 'date', 'type']).size().rename('count').reset_index()
+        counts.insert(0, 'level', level)
+        frames.append(counts)
+    cube = pd.concat(frames, ignore_index=True)
+    cube['region'] = cube['region'].astype(str)
+    cube['year'] = cube['date'].dt.year.astype('int16')
+    cube['count'] = cube['count'].astype('int32')
+    return cube[['level', 'region', 'date', 'year', 'type', 'count']]
+
+def read(path=CUBE_PATH):
+    # (cube, snapshot fingerprints) from disk, or (None, {}) if there is none
+    if not os.path.exists(path):
+        return None, {}
+    table = pq.read_table(path)
+    fingerprints = json.loads((table.schema.metadata or {}).get(FINGERPRINTS_KEY, b'{}'))
+    return table.to_pandas(), fingerprints
+
+def write(cube, fingerprints, path=CUBE_PATH):
+    cube = cube.sort_values(['level', 'region', 'date', 'type'], kind='stable').reset_index(drop=True)
+    for column in ['level', 'region', 'type']:
+        cube[column] = cube[column].astype('category')
+    table = pa.Table.from_pandas(cube, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[FINGERPRINTS_KEY] = json.dumps(fingerprints).encode()
+    tmp = f'{path}.tmp'
+    pq.write_table(table.replace_schema_metadata(metadata), tmp, compression='zstd')
+    os.replace(tmp, path)
+    return cube
+
+def build(gdf, path=CUBE_PATH):
+    # bring the cube on disk up to date with gdf and return it; snapshots whose
+    # rows are unchanged since the last build are kept as they are
+    fingerprints = snapshot_fingerprints(gdf)
+    cube, previous = read(path)
+    if cube is not None and previous == fingerprints:
+        return cube
+
+    changed = [date for date, fingerprint in fingerprints.items() if previous.get(date) != fingerprint]
+    dates = gdf['date'].dt.strftime('%Y-%m-%d')
+    fresh = aggregate(gdf[dates.isin(changed)])
+    if cube is not None:
+        kept = cube['date'].dt.strftime('%Y-%m-%d')
+        cube = cube[kept.isin(fingerprints) & ~kept.isin(changed)].copy()
+        for column in ['level', 'region', 'type']:
+            cube[column] = cube[column].astype(object)
+        fresh = pd.concat([cube, fresh], ignore_index=True)
+    print(f'Aggregated {len(changed)} of {len(fingerprints)} snapshots into {path}')
+    return write(fresh, fingerprints, path)
+
+def table(cube, level, by='year', types=None):
+    # counts for one geography level as a region x `by` (year or date) table,
+    # summed over `types` (default: every type)
+    rows = cube[cube['level'] == level]
+    if types is not None:
+        rows = rows[rows['type'].isin(types)]
+    return rows.pivot_table(index='region', columns=by, values='count', aggfunc='sum', observed=True)
@@ -0,0 +1,176 @@
+# Columnar store for the collated APRA lists.
+#
+# The data is kept as GeoParquet next to the Excel files: native point geometry,
+# categorical type/file/street_address columns and a `year` column, sorted so
+# each row group holds few years and types and reads can skip the rest. Points
+# also carry their ward, district and neighborhood (see regions.py).
+#
+# convert the existing spreadsheets (writes data/<name>.parquet for each):
+#   python data_store.py convert [data/gdf_patched.xlsx ...]
+#
+# With AIRTABLE_MIRROR_PATH set (the setting ../mirror.py syncs to), the app
+# reads the live records from the local mirror of the Airtable Vacants table
+# instead, with its own count cube.
+
+import os
+import sys
+import json
+import sqlite3
+
+import pandas as pd
+import geopandas as gpd
+
+import regions
+import cube
+
+STORE_PATH = './data/gdf_patched.parquet'
+EXCEL_PATH = './data/gdf_patched.xlsx'
+
+CATEGORICAL_COLUMNS = ['type', 'file', 'street_address']
+
+# rows per parquet row group: about one list snapshot, so a year filter skips
+# most of the file (smaller groups repeat the street_address dictionary too often)
+ROW_GROUP_SIZE = 1000
+
+# the mirror's SQLite file (unset: no mirror) and the count cube of its records
+MIRROR_PATH = os.getenv('AIRTABLE_MIRROR_PATH')
+MIRROR_CUBE_PATH = './data/cube-mirror.parquet'
+# the mirror's Airtable fields -> store columns; the scripts in .. only use the
+# address, block/lot and lat/lng fields, so the names of the list type, date and
+# source file fields are settings
+MIRROR_COLUMNS = {
+    'Address': 'street_address',
+    'Block': 'block',
+    'Lot': 'lot',
+    'lat': 'lat',
+    'lng': 'lon',
+    os.getenv('AIRTABLE_TYPE_FIELD', 'Type'): 'type',
+    os.getenv('AIRTABLE_DATE_FIELD', 'Date'): 'date',
+    os.getenv('AIRTABLE_FILE_FIELD', 'File'): 'file',
+}
+
+def parquet_path(excel_file):
+    return os.path.splitext(excel_file)[0] + '.parquet'
+
+def _clean_value(value):
+    # render ids read back from Excel as floats (e.g. block 11805.0) as '11805'
+    if pd.isna(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def prepare(df):
+    # tidy a frame read from Excel for columnar storage; returns a GeoDataFrame
+    # if it has lat/lon, otherwise a DataFrame
+    df = df.rename(columns=lambda c: str(c).strip())
+    df = df.drop(columns=[c for c in df.columns if c.startswith('Unnamed:')])
+    for column in df.columns:
+        # parquet needs one type per column: mixed columns (block, lot, ...) become strings
+        if df[column].dtype == object and df[column].dropna().map(type).nunique() > 1:
+            df[column] = df[column].map(_clean_value)
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date'])
+        df['year'] = df['date'].dt.year.astype('int16')
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    df = df.sort_values([c for c in ['year', 'type', 'date'] if c in df.columns], kind='stable')
+    df = df.reset_index(drop=True)
+    if 'lat' in df.columns and 'lon' in df.columns:
+        df = df.drop(columns=['geometry'], errors='ignore')
+        return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df.lon, df.lat), crs='EPSG:4326')
+    return df
+
+def write(df, path=STORE_PATH):
+    tmp = f'{path}.tmp'
+    df.to_parquet(tmp, index=False, compression='zstd', row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp, path)
+    print(f'Wrote {df.shape} to {path}')
+    return path
+
+def carry_regions(gdf, previous):
+    # copy ward/district/neighborhood columns and REGIONS_CHECKED from a previous
+    # version of the store for points at the same coordinates, so only new
+    # points are looked up
+    columns = [c for c in regions.REGION_COLUMNS + [regions.REGIONS_CHECKED] if c in previous.columns]
+    if not columns:
+        return gdf
+    known = pd.DataFrame(previous[['lon', 'lat'] + columns]).drop_duplicates(['lon', 'lat'])
+    known[columns] = known[columns].astype(object)
+    merged = pd.DataFrame(gdf.drop(columns=columns, errors='ignore')).merge(known, on=['lon', 'lat'], how='left')
+    return gpd.GeoDataFrame(merged, geometry='geometry', crs=gdf.crs)
+
+def convert(excel_file, path=None):
+    # convert one Excel list to parquet next to it; point data also gets its
+    # ward/district/neighborhood, reusing the assignments already in the store,
+    # and the count cube next to it is brought up to date
+    path = path or parquet_path(excel_file)
+    df = prepare(pd.read_excel(excel_file))
+    if isinstance(df, gpd.GeoDataFrame):
+        if os.path.exists(path):
+            df = carry_regions(df, gpd.read_parquet(path))
+        df = regions.assign(df)
+        for column in regions.REGION_COLUMNS:
+            df[column] = df[column].astype('category')
+        write(df, path)
+        cube.build(df, os.path.join(os.path.dirname(path), os.path.basename(cube.CUBE_PATH)))
+        return path
+    return write(df, path)
+
+def _filters(years=None, types=None):
+    filters = []
+    if years is not None:
+        filters.append(('year', 'in', [int(year) for year in years]))
+    if types is not None:
+        filters.append(('type', 'in', list(types)))
+    return filters or None
+
+def load(years=None, types=None, columns=None, path=STORE_PATH):
+    # read the store, keeping only the given years/types (pushed down to the
+    # parquet reader, so other row groups are never decoded) and columns
+    if columns is not None and 'geometry' not in columns:
+        columns = list(columns) + ['geometry']
+    gdf = gpd.read_parquet(path, columns=columns, filters=_filters(years, types))
+    print(f'Read gdf with shape {gdf.shape} from {path}')
+    return gdf
+
+def load_mirror(years=None, types=None, path=MIRROR_PATH):
+    # the mirrored records that have a point, in the store's columns; the mirror
+    # is opened read-only, so a sync can run at the same time. Raises ValueError
+    # if fields the app needs are missing (see MIRROR_COLUMNS)
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute('SELECT fields FROM records WHERE lat IS NOT NULL AND lng IS NOT NULL').fetchall()
+    finally:
+        conn.close()
+    df = pd.DataFrame([json.loads(fields) for fields, in rows])
+    df = df[[c for c in MIRROR_COLUMNS if c in df.columns]].rename(columns=MIRROR_COLUMNS)
+    missing = [c for c in ['street_address', 'lat', 'lon', 'type', 'date'] if c not in df.columns]
+    if missing:
+        raise ValueError(f'{path} has no {", ".join(missing)} (see MIRROR_COLUMNS)')
+    gdf = prepare(df)
+    if years is not None:
+        gdf = gdf[gdf['year'].isin([int(year) for year in years])]
+    if types is not None:
+        gdf = gdf[gdf['type'].isin(list(types))]
+    gdf.attrs['cube_path'] = MIRROR_CUBE_PATH
+    print(f'Read gdf with shape {gdf.shape} from {path}')
+    return gdf
+
+def is_current(path=STORE_PATH, excel_file=EXCEL_PATH):
+    # True if the parquet store exists and is at least as new as the spreadsheet
+    if not os.path.exists(path):
+        return False
+    return not os.path.exists(excel_file) or os.path.getmtime(path) >= os.path.getmtime(excel_file)
+
+def main(argv):
+    if not argv or argv[0] != 'convert':
+        print('usage: python data_store.py convert [file.xlsx ...]')
+        return 1
+    for excel_file in argv[1:] or [EXCEL_PATH]:
+        convert(excel_file)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
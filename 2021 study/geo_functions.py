@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import geopandas as gpd
 
@@ -7,14 +8,17 @@ import geopandas as gpd
 # from geopandas.tools import geocode
 
 # import json
-import datetime
+import hashlib
 # import contextily as cx
 import numpy as np
 
+import data_store
+
 def write_excel_data(gdf):
     picklefile = f'./data/gdf_patched.pkl'
     excel_file = f'./data/gdf_patched.xlsx'
     gdf.to_excel(excel_file, index=False)
+    data_store.convert(excel_file, data_store.STORE_PATH)
     return
 
 def read_excel_data():
@@ -25,84 +29,106 @@ def read_excel_data():
     print(f'Read gdf with shape {gdf.shape} from {excel_file}')
     return gdf
 
+def read_data(years=None, types=None):
+    # the live records from the Airtable mirror if AIRTABLE_MIRROR_PATH is set
+    # and it has the fields the app needs, else the collated lists from the
+    # parquet store, falling back to the spreadsheet while the store is missing
+    # or older than it
+    if data_store.MIRROR_PATH and os.path.exists(data_store.MIRROR_PATH):
+        try:
+            return data_store.load_mirror(years=years, types=types)
+        except ValueError as e:
+            print(f'Not using the mirror: {e}')
+    if data_store.is_current():
+        return data_store.load(years=years, types=types)
+    gdf = read_excel_data()
+    if years is not None:
+        gdf = gdf[gdf['date'].dt.year.isin(years)]
+    if types is not None:
+        gdf = gdf[gdf['type'].isin(types)]
+    return gdf
+
+def data_fingerprint(df, columns=None):
+    # hash of the values in `columns` (default: all), identifying one version of the data
+    data = df if columns is None else df[list(columns)]
+    hashed = pd.util.hash_pandas_object(data, index=False)
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+# trend_metrics results keyed on (data fingerprint, arguments)
+_trend_cache = {}
+TREND_CACHE_SIZE = 32
+
+def trend_metrics(gdf, categories=None, by=None, days=365):
+    """Current count and change over the last `days` per `type`, optionally per geography.
+
+    Each category is counted on the dates it was observed, in one groupby over
+    (by..., type, date), and its series is linearly interpolated with np.interp
+    only at the last observation date and `days` before it. Within a geography,
+    a date the category was observed elsewhere counts as zero.
+
+    Returns a DataFrame indexed by (*by, type) with columns current, previous
+    and delta; previous is NaN if `days` reaches back before the first
+    observation. Results are memoized on the data's fingerprint.
+    """
+    by = [by] if isinstance(by, str) else list(by or [])
+    columns = by + ['type', 'date']
+    key = (data_fingerprint(gdf, columns), None if categories is None else tuple(categories), tuple(by), days)
+    if key in _trend_cache:
+        return _trend_cache[key].copy()
+
+    data = gdf[columns]
+    if categories is not None:
+        data = data[data['type'].isin(categories)]
+    groups = by or ['_all']
+    if not by:
+        data = data.assign(_all='all')
+    counts = data.groupby(groups + ['type', 'date'], observed=True).size()
+
+    def to_days(dates):
+        return np.asarray(dates, dtype='datetime64[D]').astype(float)
+
+    end = gdf['date'].max()
+    targets = to_days([end - pd.Timedelta(days=days), end])
+
+    frames = []
+    for category, series in counts.groupby(level='type'):
+        # rows are geographies, columns the dates this category was observed on
+        table = series.droplevel('type').unstack('date', fill_value=0)
+        observed = to_days(table.columns)
+        # interpolation weights of each observation date at each target date
+        weights = np.stack([np.interp(targets, observed, unit, left=np.nan) for unit in np.eye(len(observed))])
+        previous, current = (table.to_numpy(dtype=float) @ weights).T
+        frame = pd.DataFrame({'current': current, 'previous': previous}, index=table.index)
+        frame['type'] = category
+        frames.append(frame)
+    result = pd.concat(frames).set_index('type', append=True)
+    if not by:
+        result = result.droplevel('_all')
+    result['delta'] = result['current'] - result['previous']
+
+    if len(_trend_cache) >= TREND_CACHE_SIZE:
+        _trend_cache.clear()
+    _trend_cache[key] = result
+    return result.copy()
+
 def generate_trend_metrics(gdf):
-    
-    # INTERPOLATION METHOD
-    
-    
-    ################################################################################################
-    # VACANTS
-
-    # create a time series index from earliest to latest
-    start=np.sort(gdf['date'].unique())[0]
-    end=np.sort(gdf['date'].unique())[-1]
-    index = pd.date_range(start=start, end=end, freq='D')
-    columns = ['value_to_drop']
-    date_range = pd.DataFrame(index=index, columns=columns)
-    date_range = date_range.fillna(0)
-
-    # create a new gdf of vacants
-    gdf_tmp = gdf.loc[gdf['type'] == 'Vacant' ]
-    group_vacant_annual = gdf_tmp.groupby(gdf_tmp['date'])
-    series_vacant_annual = group_vacant_annual['date'].agg('count')
-    gdf_vacant_annual = series_vacant_annual.to_frame(name='num_vacant')
-
-    # and join them
-    annual_vacants = date_range.join(gdf_vacant_annual)
-    annual_vacants = annual_vacants.drop(columns=['value_to_drop'])
-
-    # fill by interpolation
-    # https://towardsdatascience.com/how-to-interpolate-time-series-data-in-apache-spark-and-python-pandas-part-1-pandas-cff54d76a2ea
-    annual_vacants_interpolated = annual_vacants.resample('D')\
-                    .mean()
-    annual_vacants_interpolated['num_vacant'] = annual_vacants_interpolated['num_vacant'].interpolate()
-
-    # compute value for 1 year before the last recorded data point.
-    from datetime import timedelta
-    datetime.datetime.now() - timedelta(days=365)
-    ## for future use 
-    # one_year_ago_today = datetime.datetime.now() - timedelta(days=365)
-    one_year_ago_last_observed = annual_vacants_interpolated.index[-1] - timedelta(days=365)
-
-    delta_v = annual_vacants_interpolated['num_vacant'][-1] - annual_vacants_interpolated.loc[one_year_ago_last_observed]
-    
-    ################################################################################################
-    # ABANDONED
-    
-    # create a time series index from earliest to latest
-    start=np.sort(gdf['date'].unique())[0]
-    end=np.sort(gdf['date'].unique())[-1]
-    index = pd.date_range(start=start, end=end, freq='D')
-    columns = ['value_to_drop']
-    date_range = pd.DataFrame(index=index, columns=columns)
-    date_range = date_range.fillna(0)
-
-    # create a new gdf of vacants
-    gdf_tmp = gdf.loc[gdf['type'] == 'Abandoned' ]
-    group_abandoned_annual = gdf_tmp.groupby(gdf_tmp['date'])
-    series_abandoned_annual = group_abandoned_annual['date'].agg('count')
-    gdf_abandoned_annual = series_abandoned_annual.to_frame(name='num_abandoned')
-
-    # and join them
-    annual_abandoned = date_range.join(gdf_abandoned_annual)
-    annual_abandoned = annual_abandoned.drop(columns=['value_to_drop'])
-
-    # fill by interpolation
-    # https://towardsdatascience.com/how-to-interpolate-time-series-data-in-apache-spark-and-python-pandas-part-1-pandas-cff54d76a2ea
-    annual_abandoned_interpolated = annual_abandoned.resample('D')\
-                    .mean()
-    annual_abandoned_interpolated['num_abandoned'] = annual_abandoned_interpolated['num_abandoned'].interpolate()
-
-    # compute value for 1 year before the last recorded data point.
-    from datetime import timedelta
-    datetime.datetime.now() - timedelta(days=365)
-    ## for future use 
-    # one_year_ago_today = datetime.datetime.now() - timedelta(days=365)
-    one_year_ago_last_observed = annual_abandoned_interpolated.index[-1] - timedelta(days=365)
-
-    delta_a = annual_abandoned_interpolated['num_abandoned'][-1] - annual_abandoned_interpolated.loc[one_year_ago_last_observed]
-    
-    num_a = annual_abandoned_interpolated['num_abandoned'][-1]
-    num_v = annual_vacants_interpolated['num_vacant'][-1]
-    
-    return num_a, num_v, delta_a[0], delta_v[0]
\ No newline at end of file
+    # citywide counts and one-year change for abandoned and vacant buildings
+    metrics = trend_metrics(gdf, categories=['Abandoned', 'Vacant'])
+    num_a, delta_a = metrics.loc['Abandoned', ['current', 'delta']]
+    num_v, delta_v = metrics.loc['Vacant', ['current', 'delta']]
+    return num_a, num_v, delta_a, delta_v
+
+
+# marker colors on the citywide map, by type (anything else is gray)
+TYPE_COLORS = {'Abandoned': 'red', 'Vacant': 'orange'}
+
+def map_points(gdf):
+    # the columns the map needs, one row per point with coordinates
+    points = pd.DataFrame({
+        'lat': gdf.geometry.y.round(6).to_numpy(),
+        'lon': gdf.geometry.x.round(6).to_numpy(),
+        'street_address': gdf['street_address'].astype(str).to_numpy(),
+        'date': gdf['date'].dt.strftime('%Y-%m-%d').to_numpy(),
+        'type': gdf['type'].astype(str).to_numpy(),
+    })
+    return points.dropna(subset=['lat', 'lon'])
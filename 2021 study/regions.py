@@ -0,0 +1,73 @@
+# Ward / district / neighborhood assignment for the collated points.
+#
+# Each region layer is read and reprojected once per process and indexed with a
+# shapely STRtree; assign() adds the layer's columns to every point that was not
+# looked up yet, so the app can group by stored columns instead of running a
+# spatial join on every rerun. REGIONS_CHECKED marks the points looked up, so a
+# point outside every region is not looked up again.
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# shapefile and the columns taken from it, per layer
+LAYERS = {
+    'neighborhoods': ('./maps/neighborhoods/Neighborhoods3.shp', ['Nghbhd', 'District']),
+    'wards': ('./maps/wards/ward2012.shp', ['WARD2']),
+}
+
+REGION_COLUMNS = [column for _, columns in LAYERS.values() for column in columns]
+REGIONS_CHECKED = 'regions_checked'
+
+class RegionIndex:
+    # STRtree over one layer's polygons, in EPSG:4326 like the points
+
+    def __init__(self, path, columns):
+        layer = gpd.read_file(path).to_crs(epsg=4326)
+        self.columns = columns
+        self.values = layer[columns].reset_index(drop=True)
+        self.tree = shapely.STRtree(layer.geometry.values)
+
+    def lookup(self, points):
+        # columns of the polygon containing each point (first match if polygons
+        # overlap, missing if none), as a DataFrame aligned with `points`
+        point_index, region_index = self.tree.query(points, predicate='within')
+        first = pd.Series(region_index).groupby(point_index).first()
+        matched = np.full(len(points), -1)
+        matched[first.index.to_numpy()] = first.to_numpy()
+        result = self.values.reindex(matched).reset_index(drop=True)
+        return result
+
+_indexes = {}
+
+def region_index(name):
+    if name not in _indexes:
+        path, columns = LAYERS[name]
+        _indexes[name] = RegionIndex(path, columns)
+    return _indexes[name]
+
+def assign(gdf, force=False):
+    # return gdf with REGION_COLUMNS filled in and REGIONS_CHECKED set; only rows
+    # that have a point and were not looked up yet are, unless force=True
+    gdf = gdf.copy()
+    for column in REGION_COLUMNS:
+        if column not in gdf.columns or force:
+            gdf[column] = pd.Series(pd.NA, index=gdf.index, dtype=object)
+    if REGIONS_CHECKED not in gdf.columns or force:
+        # data from before the flag: the points with a region were looked up
+        gdf[REGIONS_CHECKED] = gdf[REGION_COLUMNS].notna().any(axis=1)
+    gdf[REGIONS_CHECKED] = gdf[REGIONS_CHECKED].eq(True)
+    has_point = ~(gdf.geometry.is_empty | gdf.geometry.isna() | gdf.geometry.x.isna())
+    todo = has_point & ~gdf[REGIONS_CHECKED]
+    if not todo.any():
+        return gdf
+
+    points = gdf.geometry[todo].values
+    for name in LAYERS:
+        found = region_index(name).lookup(points)
+        for column in found.columns:
+            gdf.loc[todo, column] = found[column].to_numpy()
+    gdf.loc[todo, REGIONS_CHECKED] = True
+    print(f'Assigned regions to {int(todo.sum())} of {len(gdf)} points')
+    return gdf
@@ -0,0 +1,264 @@
+# Static GeoJSON tiles for the citywide map.
+#
+# export() writes one point layer per year and type from the collated lists and,
+# if the Airtable mirror is configured (AIRTABLE_MIRROR_PATH, see data_store.py), a
+# parcel polygon layer from the geojson stored with each record. Every layer is
+# written as one compact GeoJSON file and as GeoJSON tiles in an XYZ directory
+# at TILE_ZOOM, and manifest.json lists the layers with the tiles that exist.
+# A layer is only rewritten when its fingerprint changes.
+#
+# The files go to ./static/tiles, which Streamlit serves at /app/static/tiles
+# (server.enableStaticServing, see setup.sh); map_html() is a map that fetches
+# only the tiles in view from there. Any static host can serve the directory too.
+#
+#   python tiles.py [./static/tiles]
+
+import os
+import sys
+import json
+import math
+import shutil
+import sqlite3
+import hashlib
+
+from branca.element import MacroElement
+from jinja2 import Template
+import folium
+
+import data_store
+from geo_functions import map_points, read_data, data_fingerprint, TYPE_COLORS
+
+TILES_DIR = './static/tiles'
+TILES_URL = os.getenv('APRA_TILES_URL', '/app/static/tiles')
+
+# one tile zoom for every layer: at 14 a tile is about 2 km across, so the whole
+# city is a few dozen tiles and a street-level view one to four
+TILE_ZOOM = 14
+COORDINATE_DIGITS = 6
+
+MANIFEST = 'manifest.json'
+
+def tile_x(lng, zoom=TILE_ZOOM):
+    return int((lng + 180) / 360 * 2 ** zoom)
+
+def tile_y(lat, zoom=TILE_ZOOM):
+    lat = math.radians(lat)
+    return int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * 2 ** zoom)
+
+def tiles_for(bounds, zoom=TILE_ZOOM):
+    # 'x/y' of every tile a (min_lng, min_lat, max_lng, max_lat) box touches
+    min_lng, min_lat, max_lng, max_lat = bounds
+    return [f'{x}/{y}'
+            for x in range(tile_x(min_lng, zoom), tile_x(max_lng, zoom) + 1)
+            for y in range(tile_y(max_lat, zoom), tile_y(min_lat, zoom) + 1)]
+
+def _round(coordinates):
+    if isinstance(coordinates[0], (int, float)):
+        return [round(value, COORDINATE_DIGITS) for value in coordinates[:2]]
+    return [_round(part) for part in coordinates]
+
+def _bounds(coordinates):
+    if isinstance(coordinates[0], (int, float)):
+        return coordinates[0], coordinates[1], coordinates[0], coordinates[1]
+    boxes = [_bounds(part) for part in coordinates]
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+def slug(text):
+    return ''.join(c if c.isalnum() else '-' for c in str(text).lower()).strip('-')
+
+def point_layers(points):
+    # {name: (properties of the layer, features)} for map_points() rows, one layer
+    # per year and type; year and type are layer properties, so features only
+    # carry address and date
+    points = points.copy()
+    points['year'] = points['date'].str[:4]
+    layers = {}
+    for (year, kind), rows in points.groupby(['year', 'type'], sort=True):
+        features = [
+            {'type': 'Feature', 'id': i,
+             'geometry': {'type': 'Point', 'coordinates': _round([lon, lat])},
+             'properties': {'address': address, 'date': date}}
+            for i, (lat, lon, address, date) in enumerate(rows[['lat', 'lon', 'street_address', 'date']].itertuples(index=False))
+        ]
+        layers[f'points-{year}-{slug(kind)}'] = ({'kind': 'points', 'year': int(year), 'type': kind}, features)
+    return layers
+
+def parcel_layer(path=None):
+    # {name: (properties, features)} with the parcel polygons decoded in the
+    # Airtable mirror, or {} without a mirror
+    path = path or data_store.MIRROR_PATH
+    if not path or not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT g.id, r.address, g.geometry FROM geometry g JOIN records r ON r.id = g.id"
+            " WHERE g.type != 'Point' ORDER BY g.id").fetchall()
+    finally:
+        conn.close()
+    features = []
+    for record_id, address, geometry in rows:
+        geometry = json.loads(geometry)
+        geometry['coordinates'] = _round(geometry['coordinates'])
+        features.append({'type': 'Feature', 'id': record_id, 'geometry': geometry,
+                         'properties': {'address': address}})
+    return {'parcels': ({'kind': 'parcels'}, features)} if features else {}
+
+def _dump(data):
+    return json.dumps(data, separators=(',', ':'))
+
+def write_layer(out_dir, name, features):
+    # the layer's whole-file GeoJSON and its tiles; returns {tile: feature count}
+    tiles = {}
+    for feature in features:
+        for tile in tiles_for(_bounds(feature['geometry']['coordinates'])):
+            tiles.setdefault(tile, []).append(feature)
+    tmp = os.path.join(out_dir, f'{name}.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    for tile, tile_features in tiles.items():
+        path = os.path.join(tmp, str(TILE_ZOOM), f'{tile}.geojson')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(_dump({'type': 'FeatureCollection', 'features': tile_features}))
+    with open(os.path.join(tmp, 'layer.geojson'), 'w') as f:
+        f.write(_dump({'type': 'FeatureCollection', 'features': features}))
+    final = os.path.join(out_dir, name)
+    shutil.rmtree(final, ignore_errors=True)
+    os.rename(tmp, final)
+    return {tile: len(tile_features) for tile, tile_features in tiles.items()}
+
+def read_manifest(out_dir=TILES_DIR):
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {'tile_zoom': TILE_ZOOM, 'layers': {}}
+    with open(path) as f:
+        return json.load(f)
+
+def _source(points, mirror_path):
+    # identifies the input: the points, and the mirror file's version if there is one
+    mirror_path = mirror_path or data_store.MIRROR_PATH
+    mirror = os.path.getmtime(mirror_path) if mirror_path and os.path.exists(mirror_path) else None
+    return f'{TILE_ZOOM}:{data_fingerprint(points)}:{mirror}'
+
+def export(gdf, out_dir=TILES_DIR, mirror_path=None):
+    # bring the tiles in out_dir up to date with gdf (and the mirror's parcels);
+    # returns the manifest straight away if neither changed since the last
+    # export, and otherwise only rewrites the layers that changed
+    os.makedirs(out_dir, exist_ok=True)
+    points = map_points(gdf)
+    source = _source(points, mirror_path)
+    previous = read_manifest(out_dir)
+    if previous.get('source') == source:
+        return previous
+    if previous.get('tile_zoom') != TILE_ZOOM:
+        previous = {'layers': {}}
+    layers = dict(point_layers(points), **parcel_layer(mirror_path))
+
+    manifest = {'tile_zoom': TILE_ZOOM, 'source': source, 'layers': {}}
+    written = 0
+    for name, (properties, features) in layers.items():
+        fingerprint = hashlib.sha1(_dump(features).encode()).hexdigest()
+        entry = previous['layers'].get(name)
+        if entry is None or entry['fingerprint'] != fingerprint or not os.path.isdir(os.path.join(out_dir, name)):
+            tiles = write_layer(out_dir, name, features)
+            entry = dict(properties, fingerprint=fingerprint, features=len(features), tiles=sorted(tiles))
+            written += 1
+        manifest['layers'][name] = entry
+    for name in set(previous['layers']) - set(layers):
+        shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+
+    tmp = os.path.join(out_dir, f'{MANIFEST}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST))
+    if written:
+        print(f'Exported {written} of {len(layers)} map layers to {out_dir}')
+    return manifest
+
+class TileLayers(MacroElement):
+    # loads the GeoJSON tiles of the named layers that are in view, as the map moves
+    _template = Template('''
+        {% macro script(this, kwargs) %}
+        (function () {
+            var map = {{ this._parent.get_name() }};
+            var base = {{ this.url|tojson }};
+            var names = {{ this.layers|tojson }};
+            var colors = {{ this.colors|tojson }};
+            fetch(base + '/manifest.json').then(function (r) { return r.json(); }).then(function (manifest) {
+                var zoom = manifest.tile_zoom;
+                var requested = {}, seen = {};
+                function tileX(lng) { return Math.floor((lng + 180) / 360 * Math.pow(2, zoom)); }
+                function tileY(lat) {
+                    var rad = lat * Math.PI / 180;
+                    return Math.floor((1 - Math.log(Math.tan(rad) + 1 / Math.cos(rad)) / Math.PI) / 2 * Math.pow(2, zoom));
+                }
+                var groups = {};
+                names.forEach(function (name) {
+                    var layer = manifest.layers[name];
+                    if (!layer) { return; }
+                    layer.available = new Set(layer.tiles);
+                    var color = colors[layer.type] || 'gray';
+                    groups[name] = L.geoJSON(null, {
+                        filter: function (feature) {
+                            var key = name + ':' + feature.id;
+                            if (seen[key]) { return false; }
+                            return seen[key] = true;
+                        },
+                        pointToLayer: function (feature, latlng) {
+                            return L.circleMarker(latlng, {radius: 5, color: color, fillColor: color, fillOpacity: 0.7});
+                        },
+                        style: layer.kind === 'parcels' ? {color: '#444', weight: 1, fillOpacity: 0.1} : undefined,
+                        onEachFeature: function (feature, marker) {
+                            marker.bindPopup(function () {
+                                var p = feature.properties;
+                                return 'Address: ' + p.address + (p.date ? '<br>Date: ' + p.date + '<br>Status: ' + layer.type : '');
+                            }, {minWidth: 250, maxWidth: 250});
+                        }
+                    }).addTo(map);
+                });
+                function load() {
+                    var b = map.getBounds();
+                    for (var x = tileX(b.getWest()); x <= tileX(b.getEast()); x++) {
+                        for (var y = tileY(b.getNorth()); y <= tileY(b.getSouth()); y++) {
+                            Object.keys(groups).forEach(function (name) {
+                                var tile = x + '/' + y, key = name + '/' + tile;
+                                if (requested[key] || !manifest.layers[name].available.has(tile)) { return; }
+                                requested[key] = true;
+                                fetch(base + '/' + name + '/' + zoom + '/' + tile + '.geojson')
+                                    .then(function (r) { return r.json(); })
+                                    .then(function (data) { groups[name].addData(data); });
+                            });
+                        }
+                    }
+                }
+                map.on('moveend', load);
+                load();
+            });
+        })();
+        {% endmacro %}
+    ''')
+
+    def __init__(self, layers, url=TILES_URL, colors=None):
+        super().__init__()
+        self._name = 'TileLayers'
+        self.layers = list(layers)
+        self.url = url
+        self.colors = colors or TYPE_COLORS
+
+def map_html(layers, url=TILES_URL):
+    # a small map page that fetches the named layers' tiles in view from url;
+    # no data is embedded, so it is the same page whatever the data
+    map = folium.Map(location=[40.725, -74.075], tiles='Stamen Toner', zoom_start=13)
+    TileLayers(layers, url).add_to(map)
+    return map.get_root().render()
+
+def main(argv):
+    out_dir = argv[0] if argv else TILES_DIR
+    manifest = export(read_data(), out_dir)
+    for name, layer in manifest['layers'].items():
+        print(f"{name}: {layer['features']} features in {len(layer['tiles'])} tiles")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
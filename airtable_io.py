@@ -0,0 +1,272 @@
+import os
+import re
+import math
+import time
+import queue
+import threading
+
+import requests
+
+import upstream
+import metrics
+
+# Airtable accepts at most 10 records per create/update request
+AIRTABLE_BATCH_SIZE = 10
+
+# Fields that only record when a value was last checked; they are written along
+# with real changes but never cause a write on their own
+FRESHNESS_FIELDS = {"tax_updated"}
+
+# How far apart two numbers may be and still count as the same value
+FIELD_TOLERANCE = {"tax_balance": 0.005}
+DEFAULT_TOLERANCE = 1e-7
+
+# "$1,234.50", "-12", "(45.00)": amounts as the tax site and Airtable's currency fields render them
+# A single optional sign, before or after the dollar sign, and at least one digit
+AMOUNT_PATTERN = re.compile(r"^\(?(?:-?\$|\$?-)?\s*(?:\d[\d,]*(?:\.\d*)?|\.\d+)\)?$")
+
+# Base REST endpoint, without the base id and table name
+AIRTABLE_API_URL = os.getenv("AIRTABLE_API_URL", "https://api.airtable.com/v0")
+
+
+def table_url(base_id, table_name):
+    return f"{AIRTABLE_API_URL}/{base_id}/{table_name}"
+
+
+def auth_headers(api_key):
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def request_with_retry(method, url, max_retries=5, **kwargs):
+    """Send an Airtable request, waiting out 429s (Retry-After) and retrying
+    connection errors and 5xx with backoff.
+
+    Returns the last response, whatever its status, or raises the last connection error.
+    """
+    for attempt in range(max_retries + 1):
+        if attempt:
+            metrics.registry.count_retry("airtable")
+        try:
+            response = upstream.request("airtable", method, url, **kwargs)
+        except requests.RequestException:
+            if attempt == max_retries:
+                raise
+            time.sleep(2 ** attempt)
+            continue
+        if response.status_code == 429 and attempt < max_retries:
+            # Airtable asks clients to wait 30 seconds after hitting the limit
+            delay = float(response.headers.get("Retry-After", 30))
+            print(f"Airtable rate limit hit, retrying in {delay:.0f}s")
+            time.sleep(delay)
+        elif response.status_code >= 500 and attempt < max_retries:
+            time.sleep(2 ** attempt)
+        else:
+            return response
+
+
+def iter_records(url, headers, formula=None, fields=None, page_size=100):
+    """Yield records from an Airtable table page by page, so callers can start before the last page arrives.
+
+    formula is passed as filterByFormula so Airtable only returns matching records,
+    and fields limits which fields are returned for each record.
+    """
+    params = {"pageSize": page_size}
+    if formula:
+        params["filterByFormula"] = formula
+    if fields:
+        params["fields[]"] = fields
+
+    while True:
+        response = request_with_retry("GET", url, headers=headers, params=params)
+        response.raise_for_status()
+        response_data = response.json()
+
+        yield from response_data.get("records", [])
+
+        if "offset" in response_data:
+            params["offset"] = response_data["offset"]
+        else:
+            break
+
+
+class AirtableWriteBuffer:
+    """Collect record updates and PATCH them to Airtable in batches from background threads.
+
+    Usage:
+        buffer = AirtableWriteBuffer(AIRTABLE_URL, HEADERS)
+        buffer.add(record_id, {"field": "value"})
+        failed = buffer.close()
+
+    on_written, if given, is called with the list of record ids in each batch
+    once Airtable has accepted it.
+    """
+
+    def __init__(self, url, headers, batch_size=AIRTABLE_BATCH_SIZE, flush_interval=1.0,
+                 workers=2, max_retries=5, on_written=None):
+        self.url = url
+        self.on_written = on_written
+        self.headers = headers
+        self.batch_size = min(batch_size, AIRTABLE_BATCH_SIZE)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.failed = []
+        self.written = 0
+        self.requests = 0
+        self.closed = False
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, record_id, fields):
+        """Queue an update; it is sent with the next batch."""
+        if self.closed:
+            raise RuntimeError("AirtableWriteBuffer is closed")
+        self.pending.put({"id": record_id, "fields": fields})
+
+    def close(self):
+        """Flush everything still queued, stop the workers and return the failed updates."""
+        self.closed = True
+        for _ in self.threads:
+            self.pending.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.failed
+
+    def _next_batch(self):
+        """Block for the first update, then gather more until the batch is full or the interval passes.
+
+        Returns (batch, stop) where stop is True once the close() sentinel was seen.
+        """
+        first = self.pending.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                self._send(batch)
+            if stop:
+                return
+
+    @metrics.timed("airtable_update")
+    def _send(self, batch):
+        """PATCH one batch with request_with_retry; a batch Airtable rejects is resent record by record."""
+        with self.lock:
+            self.requests += 1
+        try:
+            response = request_with_retry("PATCH", self.url, max_retries=self.max_retries,
+                                          headers=self.headers, json={"records": batch})
+        except Exception as e:
+            error = f"Exception: {str(e)}"
+        else:
+            if response.status_code == 200:
+                with self.lock:
+                    self.written += len(batch)
+                print(f"Wrote batch of {len(batch)} records to Airtable")
+                if self.on_written:
+                    # The records are written either way; a failing callback
+                    # must not stop this worker
+                    try:
+                        self.on_written([item["id"] for item in batch])
+                    except Exception as e:
+                        print(f"Error in on_written for {len(batch)} written records: {str(e)}")
+                return
+            error = f"Failed to update: {response.status_code} {response.text}"
+            if response.status_code != 429 and response.status_code < 500 and len(batch) > 1:
+                # A single invalid record rejects the whole batch; send them one by one
+                # so the others still get written
+                for item in batch:
+                    self._send([item])
+                return
+
+        print(f"ERROR: Giving up on {len(batch)} records: {error}")
+        with self.lock:
+            self.failed.extend({"id": item["id"], "fields": item["fields"], "error": error} for item in batch)
+
+    def summary(self):
+        """Return a one-line summary of the writes made so far."""
+        return (f"{self.written} records written in {self.requests} requests, "
+                f"{len(self.failed)} failed")
+
+
+def missing_formula(*fields):
+    """Airtable formula matching records where any of the fields is empty."""
+    return "OR(" + ", ".join(f"{{{field}}} = BLANK()" for field in fields) + ")"
+
+
+def stale_formula(field, days):
+    """Airtable formula matching records whose date field is empty or older than `days`."""
+    return (f"OR({{{field}}} = BLANK(), "
+            f"IS_BEFORE({{{field}}}, DATEADD(TODAY(), -{int(days)}, 'days')))")
+
+
+def any_formula(*formulas):
+    """Combine formulas so a record matches if any of them does."""
+    if len(formulas) == 1:
+        return formulas[0]
+    return "OR(" + ", ".join(formulas) + ")"
+
+
+def report_failures(failed):
+    """Print the updates that could not be written."""
+    for item in failed:
+        print(f"Failed to update record {item['id']}: {item['error']}")
+
+
+def comparable_value(value):
+    """Normalize a field value for comparison: empty values are None, amounts and
+    numbers are floats and other text has its whitespace collapsed."""
+    if value is None or value == "" or value == []:
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = " ".join(value.split())
+        if AMOUNT_PATTERN.match(text):
+            amount = float(re.sub(r"[$,()\s]", "", text))
+            return -abs(amount) if text.startswith("(") else amount
+        return text or None
+    return value
+
+
+def same_value(field, old, new):
+    """True if writing `new` over `old` would not change what the field means."""
+    old, new = comparable_value(old), comparable_value(new)
+    if isinstance(old, float) and isinstance(new, float):
+        return math.isclose(old, new, rel_tol=0, abs_tol=FIELD_TOLERANCE.get(field, DEFAULT_TOLERANCE))
+    return old == new
+
+
+def changed_fields(current, updates, freshness=FRESHNESS_FIELDS):
+    """The updates that would change the record's current fields.
+
+    Freshness fields are left out when nothing else changed and kept otherwise,
+    so an unchanged record needs no write at all.
+    """
+    changes = {field: value for field, value in updates.items()
+               if field not in freshness and not same_value(field, current.get(field), value)}
+    if changes:
+        changes.update({field: value for field, value in updates.items() if field in freshness})
+    return changes
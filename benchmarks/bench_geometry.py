@@ -0,0 +1,120 @@
+"""Compare geojson field formats: the raw njparcels response vs geometry.encode_geometry.
+
+Reports the average stored size, encode/decode time and how far the decoded
+parcel's representative point moves, over synthetic njparcels-like responses.
+By default the parcels are irregular rings with no collinear runs, which gives
+simplification little to drop; --collinear uses rectangular lots with many
+points along each edge, where the simplified ratios are an upper bound.
+
+Run from the repository root:
+    python benchmarks/bench_geometry.py [--parcels N] [--vertices N] [--collinear]
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from geometry import encode_geometry, decode_geometry, representative_point
+
+# (label, encoding, precision, tolerance in degrees)
+FORMATS = [
+    ("json p6", "json", 6, 0.0),
+    ("polyline p6", "polyline", 6, 0.0),
+    ("polyline p6 t1e-6", "polyline", 6, 1e-6),
+    ("polyline p5 t5e-6", "polyline", 5, 5e-6),
+]
+
+# njparcels attributes returned alongside the geometry
+PROPERTIES = {
+    "pin": "0906_11805_12", "muni": "Jersey City", "county": "Hudson", "block": "11805", "lot": "12",
+    "qual": None, "property_class": "2", "property_location": "163 CLERK ST",
+    "owner_name": "SAMPLE OWNER LLC", "owner_address": "PO BOX 1234", "owner_city": "JERSEY CITY, NJ",
+    "owner_zip": "07305", "land_value": 98700, "improvement_value": 151300, "net_value": 250000,
+    "last_sale_date": "2015-06-30", "last_sale_price": 185000, "building_description": "2S-F-2U",
+    "acreage": 0.0574, "calc_acreage": 0.0571, "year_constructed": 1920, "zoning": "R-1",
+}
+
+
+def irregular_ring(rng, vertices, width, depth):
+    """Vertices at uneven angles and radii around the lot, so no three are collinear."""
+    angles = sorted(rng.random() * 2 * math.pi for _ in range(vertices))
+    return [(width / 2 * (1 + math.cos(a) * rng.uniform(0.7, 1.0)), depth / 2 * (1 + math.sin(a) * rng.uniform(0.7, 1.0)))
+            for a in angles]
+
+
+def collinear_ring(rng, vertices, width, depth):
+    """A rectangle with many points along each edge, as surveyed lots sometimes have."""
+    corners = [(0, 0), (width, 0), (width, depth), (0, depth)]
+    ring = []
+    per_edge = max(1, vertices // 4)
+    for (x0, y0), (x1, y1) in zip(corners, corners[1:] + corners[:1]):
+        for i in range(per_edge):
+            t = i / per_edge
+            jitter = rng.gauss(0, 2e-7)
+            ring.append((x0 + (x1 - x0) * t + jitter, y0 + (y1 - y0) * t + jitter))
+    return ring
+
+
+def synthetic_response(rng, vertices, shape=irregular_ring):
+    """A parcel-shaped polygon with `vertices` points wrapped like an njparcels response."""
+    lat, lng = 40.68 + rng.random() * 0.09, -74.11 + rng.random() * 0.07
+    width, depth = 0.00006 + rng.random() * 0.0001, 0.00025 + rng.random() * 0.0002
+    angle = rng.random() * math.pi
+    ring = [[lng + x * math.cos(angle) - y * math.sin(angle), lat + x * math.sin(angle) + y * math.cos(angle)]
+            for x, y in shape(rng, vertices, width, depth)]
+    ring.append(ring[0])
+    return {"type": "Feature", "properties": PROPERTIES, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+
+
+def metres(a, b):
+    dx = (a[0] - b[0]) * 111320 * math.cos(math.radians(a[1]))
+    dy = (a[1] - b[1]) * 110540
+    return math.hypot(dx, dy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="geojson field format benchmark")
+    parser.add_argument("--parcels", type=int, default=2000)
+    parser.add_argument("--vertices", type=int, default=40, help="vertices per parcel (default: 40)")
+    parser.add_argument("--collinear", action="store_true",
+                        help="rectangular lots with collinear edge points instead of irregular rings")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    shape = collinear_ring if args.collinear else irregular_ring
+    responses = [synthetic_response(rng, args.vertices, shape) for _ in range(args.parcels)]
+    raw = [json.dumps(response) for response in responses]
+    raw_size = sum(len(text) for text in raw) / len(raw)
+    points = [representative_point(response) for response in responses]
+
+    start = time.perf_counter()
+    for text in raw:
+        decode_geometry(text)
+    raw_decode = (time.perf_counter() - start) / len(raw) * 1e6
+
+    print(f"{args.parcels} {'collinear' if args.collinear else 'irregular'} parcels, {args.vertices} vertices each")
+    if args.collinear:
+        print("collinear edges simplify away almost entirely: the t* ratios are an upper bound")
+    print(f"{'format':<20}{'bytes':>8}{'ratio':>8}{'encode us':>11}{'decode us':>11}{'max shift m':>13}")
+    print(f"{'raw response':<20}{raw_size:>8.0f}{1:>8.2f}{'-':>11}{raw_decode:>11.1f}{0:>13.3f}")
+    for label, encoding, precision, tolerance in FORMATS:
+        start = time.perf_counter()
+        encoded = [encode_geometry(response, encoding, precision, tolerance) for response in responses]
+        encode = (time.perf_counter() - start) / len(responses) * 1e6
+
+        start = time.perf_counter()
+        decoded = [decode_geometry(text) for text in encoded]
+        decode = (time.perf_counter() - start) / len(encoded) * 1e6
+
+        size = sum(len(text) for text in encoded) / len(encoded)
+        shift = max(metres(point, representative_point(geometry)) for point, geometry in zip(points, decoded))
+        print(f"{label:<20}{size:>8.0f}{raw_size / size:>8.2f}{encode:>11.1f}{decode:>11.1f}{shift:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
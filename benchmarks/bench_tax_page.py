@@ -0,0 +1,86 @@
+"""Compare tax page parse time: the original BeautifulSoup loop vs tax_page.parse_tax_html.
+
+Run from the repository root:
+    python benchmarks/bench_tax_page.py [--repeat N]
+"""
+import os
+import sys
+import glob
+import timeit
+import argparse
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tax_page import parse_tax_html
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def legacy_parse(html):
+    """The row-by-row parser get_tax_account_info used before tax_page existed."""
+    soup = BeautifulSoup(html, 'html.parser')
+    account_data = {}
+
+    account_info = soup.find('input', {'id': 'sAccountNumber'})
+    if account_info and account_info.get('value'):
+        account_data["account_number"] = account_info.get('value')
+
+    for row in soup.find_all('div', class_='row'):
+        if not account_data.get("account_number") and row.find('div', string=lambda text: text and 'Account#:' in text):
+            account_div = row.find('div', class_='col-md-2')
+            if account_div and account_div.find('span', class_='red'):
+                account_data["account_number"] = account_div.find('span', class_='red').get_text(strip=True)
+        for label, field in (("Location:", "location"), ("Address:", "address"), ("City/State:", "city_state")):
+            if row.find('div', string=lambda text: text and label in text):
+                div = row.find('div', class_='col-md-2')
+                if div and div.find('span', class_='red'):
+                    account_data[field] = div.find('span', class_='red').get_text(strip=True)
+        for label, field in (("Principal:", "principal"), ("Total:", "total")):
+            if row.find('div', string=lambda text: text and label in text):
+                div = row.find('div', class_='col-md-1', style="text-align:right")
+                if div and div.find('span', class_='red'):
+                    account_data[field] = div.find('span', class_='red').get_text(strip=True)
+
+    error_messages = soup.find('div', {'class': 'validation-summary-errors'})
+    if error_messages:
+        account_data["errors"] = [li.text for li in error_messages.find_all('li')]
+
+    if "total" in account_data:
+        try:
+            account_data["tax_balance"] = float(account_data["total"].replace("$", "").replace(",", ""))
+        except ValueError:
+            account_data["tax_balance"] = account_data["total"]
+    return account_data
+
+
+def fast_parse(html):
+    record = parse_tax_html(html)
+    data = record.fields()
+    if record.errors is not None:
+        data["errors"] = record.errors
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200, help="parses per page per implementation")
+    args = parser.parse_args()
+
+    print(f"{'page':<28}{'bytes':>8}{'legacy ms':>12}{'fast ms':>10}{'speedup':>9}")
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "viewpay_*.html"))):
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+
+        if legacy_parse(html) != fast_parse(html):
+            print(f"MISMATCH on {os.path.basename(path)}:\n  legacy: {legacy_parse(html)}\n  fast:   {fast_parse(html)}")
+            sys.exit(1)
+
+        legacy = timeit.timeit(lambda: legacy_parse(html), number=args.repeat) / args.repeat * 1000
+        fast = timeit.timeit(lambda: fast_parse(html), number=args.repeat) / args.repeat * 1000
+        print(f"{os.path.basename(path):<28}{len(html):>8}{legacy:>12.3f}{fast:>10.3f}{legacy / fast:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark the enrichment scripts offline against local stand-ins for every upstream service.
+
+Starts the stand-ins from stub_servers.py, loads a synthetic Vacants table and
+runs each mode in a subprocess pointed at them, then reports records/sec and
+the requests each service received.
+
+Run from the repository root, e.g.:
+    python benchmarks/run_bench.py --records 1000 --latency 0.02 --error-rate 0.01
+    python benchmarks/run_bench.py --records 10000 --modes pipeline --unthrottled
+    python benchmarks/run_bench.py --records 300 --modes get_taxes,pipeline --rerun
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+from stub_servers import start_all, synthetic_records, AirtableTable
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MODES = {
+    "get_geo": ["get_geo.py"],
+    "get_geo-incremental": ["get_geo.py", "--incremental"],
+    "get_taxes": ["get_taxes.py"],
+    "pipeline": ["pipeline.py"],
+    "pipeline-incremental": ["pipeline.py", "--incremental"],
+    "get_taxes-mirror": ["get_taxes.py", "--mirror"],
+    "pipeline-mirror": ["pipeline.py", "--mirror"],
+}
+
+# Lifts the per-service limits so only the stand-ins' latency bounds throughput
+UNTHROTTLED = {
+    "GOOGLE_RATE": "10000", "GOOGLE_BURST": "10000", "GOOGLE_CONCURRENCY": "32",
+    "NJPARCELS_RATE": "10000", "NJPARCELS_BURST": "10000", "NJPARCELS_CONCURRENCY": "32",
+    "AIRTABLE_RATE": "10000", "AIRTABLE_BURST": "10000",
+    "TAXSITE_RATE": "10000", "TAXSITE_BURST": "10000", "TAXSITE_CONCURRENCY": "32",
+    "GEO_WORKERS": "64",
+}
+
+
+def run_mode(name, servers, env, records, log_dir, reset=True):
+    if reset:
+        servers["airtable"].handler = AirtableTable([dict(r, fields=dict(r["fields"])) for r in records])
+    for server in servers.values():
+        server.reset_counts()
+
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{name}{'' if reset else '-rerun'}.log")
+    start = time.monotonic()
+    with open(log_path, "w") as log:
+        result = subprocess.run([sys.executable] + MODES[name], cwd=ROOT, env=env,
+                                stdout=log, stderr=subprocess.STDOUT)
+    elapsed = time.monotonic() - start
+    if result.returncode != 0:
+        print(f"{name} exited with {result.returncode}, see {log_path}")
+
+    counts = {service: server.counts.get("requests", 0) for service, server in servers.items()}
+    throttled = sum(server.counts.get("429", 0) for server in servers.values())
+    return elapsed, counts, throttled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline enrichment benchmark")
+    parser.add_argument("--records", type=int, default=1000, help="synthetic table size (default: 1000)")
+    parser.add_argument("--done-fraction", type=float, default=0.0,
+                        help="share of records that already have lat/lng/geojson")
+    parser.add_argument("--duplicate-fraction", type=float, default=0.0,
+                        help="share of records repeating an earlier record's property")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="mean stand-in latency in seconds (the tax site gets 4x)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--airtable-rate-limit", type=int, default=5,
+                        help="Airtable stand-in requests/sec before it answers 429")
+    parser.add_argument("--modes", default="get_geo,get_taxes,pipeline",
+                        help=f"comma-separated modes: {', '.join(MODES)}")
+    parser.add_argument("--warm", action="store_true",
+                        help="run every mode a second time with the lookup cache left warm")
+    parser.add_argument("--rerun", action="store_true",
+                        help="run every mode a second time against the table its first run updated")
+    parser.add_argument("--unthrottled", action="store_true",
+                        help="lift the production rate limits in upstream.SERVICES")
+    args = parser.parse_args()
+
+    records = synthetic_records(args.records, args.done_fraction, duplicate_fraction=args.duplicate_fraction)
+    servers, stub_env = start_all(records, args.latency, args.error_rate, args.airtable_rate_limit)
+    work_dir = tempfile.mkdtemp(prefix="apra-bench-")
+    print(f"{args.records} records, latency {args.latency}s, error rate {args.error_rate:.0%}, logs in {work_dir}")
+
+    print(f"{'mode':<26}{'seconds':>9}{'rec/s':>9}{'google':>8}{'parcels':>9}{'taxsite':>9}"
+          f"{'airtable':>10}{'total':>8}{'429s':>6}")
+    try:
+        for name in args.modes.split(","):
+            cache_dir = os.path.join(work_dir, name)
+            env = dict(os.environ, **stub_env, LOOKUP_CACHE_PATH=os.path.join(cache_dir, "lookups.sqlite"),
+                       TAX_ACCOUNTS_PATH=os.path.join(cache_dir, "tax_accounts.sqlite"),
+                       RUN_JOURNAL_DIR=cache_dir, METRICS_DIR=cache_dir,
+                       AIRTABLE_MIRROR_PATH=os.path.join(cache_dir, "vacants.sqlite"))
+            if args.unthrottled:
+                env.update(UNTHROTTLED)
+            runs = ["cold"] + (["warm"] if args.warm else []) + (["rerun"] if args.rerun else [])
+            for label in runs:
+                elapsed, counts, throttled = run_mode(name, servers, env, records, cache_dir, reset=label != "rerun")
+                title = f"{name} ({label})" if len(runs) > 1 else name
+                print(f"{title:<26}{elapsed:>9.1f}{args.records / elapsed:>9.1f}{counts['google']:>8}"
+                      f"{counts['njparcels']:>9}{counts['taxsite']:>9}{counts['airtable']:>10}"
+                      f"{sum(counts.values()):>8}{throttled:>6}")
+    finally:
+        for server in servers.values():
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
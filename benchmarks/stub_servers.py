@@ -0,0 +1,366 @@
+"""Local stand-ins for Google Geocoding, njparcels, the city tax site and Airtable.
+
+Each stand-in is a threaded HTTP server with configurable latency, error rate
+and a requests-per-second limit above which it answers 429. They only
+implement the endpoints the enrichment scripts use.
+"""
+import os
+import re
+import json
+import time
+import datetime
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Account number on the fixture page, swapped for each parcel's own number
+FIXTURE_ACCOUNT = "118204"
+
+STREETS = ["ACADEMY STREET", "Bergen Ave", "Clerk St", "Ocean Ave", "MLK DRIVE", "Summit Ave",
+           "Montgomery Street", "Communipaw Ave", "Kennedy Blvd", "Jackson Ave"]
+
+
+def _digest(*parts):
+    return int(hashlib.md5("|".join(str(p) for p in parts).encode()).hexdigest()[:8], 16)
+
+
+def synthetic_point(key):
+    """A stable point inside Jersey City for any key."""
+    h = _digest(key)
+    return 40.68 + (h % 10000) / 10000 * 0.09, -74.11 + (h // 10000 % 10000) / 10000 * 0.07
+
+
+def synthetic_records(count, done_fraction=0.0, seed=0, duplicate_fraction=0.0):
+    """Build Vacants-like records; done_fraction of them already have lat/lng/geojson and
+    duplicate_fraction repeat an earlier record's property, spelled differently (as
+    when the same building appears in several yearly lists)."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        block, lot = 100 + i // 20, 1 + i % 20
+        fields = {
+            "Address": f"{1 + rng.randrange(400)} {rng.choice(STREETS)}",
+            "Block": str(block),
+            "Lot": str(lot),
+        }
+        if records and rng.random() < duplicate_fraction:
+            original = rng.choice(records)["fields"]
+            fields = {
+                "Address": original["Address"].upper().replace("STREET", "ST").replace("AVE", "AVENUE"),
+                "Block": original["Block"],
+                "Lot": original["Lot"] + ".00",
+            }
+            block, lot = fields["Block"], original["Lot"]
+        if rng.random() < done_fraction:
+            lat, lng = synthetic_point(f"{block}_{lot}")
+            fields.update({"lat": lat, "lng": lng, "geojson": json.dumps(parcel_feature(block, lot))})
+        records.append({"id": f"rec{i:08d}", "createdTime": "2024-12-01T00:00:00.000Z", "fields": fields})
+    return records
+
+
+def parcel_feature(block, lot):
+    lat, lng = synthetic_point(f"{block}_{lot}")
+    d = 0.00012
+    ring = [[lng, lat], [lng + d, lat], [lng + d, lat + d * 1.6], [lng + d * 0.4, lat + d * 1.7],
+            [lng, lat + d * 1.6], [lng, lat]]
+    return {
+        "type": "Feature",
+        "properties": {"pin": f"0906_{block}_{lot}", "block": str(block), "lot": str(lot),
+                       "muni": "Jersey City", "property_class": "2"},
+        "geometry": {"type": "Polygon", "coordinates": [ring]},
+    }
+
+
+class StubServer:
+    """A ThreadingHTTPServer running one stand-in on a free localhost port."""
+
+    def __init__(self, name, handler, latency=0.0, error_rate=0.0, rate_limit=None, retry_after=1):
+        self.name = name
+        self.handler = handler
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.window = []
+        self.rng = random.Random(name)
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, headers, payload = stub.respond(self.command, self.path, body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PATCH = _handle
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, key):
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def reset_counts(self):
+        with self.lock:
+            self.counts = {}
+
+    def respond(self, method, path, body):
+        with self.lock:
+            self._count("requests")
+            now = time.monotonic()
+            if self.rate_limit:
+                self.window = [t for t in self.window if now - t < 1.0]
+                if len(self.window) >= self.rate_limit:
+                    self._count("429")
+                    return 429, {"Retry-After": str(self.retry_after)}, b'{"errors":[{"error":"RATE_LIMIT_REACHED"}]}'
+                self.window.append(now)
+            failed = self.rng.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency * (0.5 + self.rng.random()))
+        if failed:
+            with self.lock:
+                self._count("500")
+            return 500, {"Content-Type": "text/plain"}, b"stub error"
+        status, headers, payload = self.handler(method, path, body)
+        with self.lock:
+            self._count(str(status))
+        return status, headers, payload
+
+
+def _json(status, data):
+    return status, {"Content-Type": "application/json"}, json.dumps(data).encode()
+
+
+def google_handler(method, path, body):
+    query = parse_qs(urlparse(path).query)
+    address = query.get("address", [""])[0]
+    lat, lng = synthetic_point(address)
+    return _json(200, {"status": "OK", "results": [
+        {"formatted_address": address, "geometry": {"location": {"lat": lat, "lng": lng}}}]})
+
+
+def njparcels_handler(method, path, body):
+    name = urlparse(path).path.rsplit("/", 1)[-1].replace(".json", "")
+    parts = name.split("_")
+    if len(parts) != 3:
+        return _json(404, {"error": "not found"})
+    return _json(200, parcel_feature(parts[1], parts[2]))
+
+
+class TaxSite:
+    """ViewPay stand-in: the search form POST and direct account pages."""
+
+    def __init__(self):
+        with open(os.path.join(FIXTURES, "viewpay_account.html"), encoding="utf-8") as f:
+            self.account_page = f.read()
+        with open(os.path.join(FIXTURES, "viewpay_no_account.html"), encoding="utf-8") as f:
+            self.no_account_page = f.read()
+
+    @staticmethod
+    def account_for(block, lot):
+        return str(100000 + _digest(block, lot) % 900000)
+
+    def page(self, account):
+        html = self.account_page.replace(FIXTURE_ACCOUNT, account)
+        return 200, {"Content-Type": "text/html"}, html.encode()
+
+    def __call__(self, method, path, body):
+        query = parse_qs(urlparse(path).query)
+        if method == "POST":
+            form = parse_qs(body.decode())
+            block, lot = form.get("Block", [""])[0], form.get("Lot", [""])[0]
+            if not block or not lot:
+                return 200, {"Content-Type": "text/html"}, self.no_account_page.encode()
+            return self.page(self.account_for(block, lot))
+        return self.page(query.get("accountNumber", ["115998"])[0])
+
+
+# A field reference, a string, a number, a function name or a single character
+FORMULA_TOKEN = re.compile(r"\s*(?:(\{[^}]*\})|('[^']*')|(-?\d+(?:\.\d+)?)|([A-Z_]+)|(\S))")
+
+
+def parse_formula(text):
+    """Parse the part of Airtable's formula language the scripts send (see
+    missing_formula, stale_formula, any_formula and modified_since_formula)
+    into nested (function, *arguments) tuples."""
+    tokens = FORMULA_TOKEN.findall(text)
+    position = 0
+
+    def expect(symbol):
+        nonlocal position
+        if position >= len(tokens) or tokens[position][4] != symbol:
+            raise ValueError(f"expected {symbol!r} in formula {text!r}")
+        position += 1
+
+    def term():
+        nonlocal position
+        field, string, number, name, other = tokens[position]
+        position += 1
+        if field:
+            return ("field", field[1:-1])
+        if string:
+            return ("value", string[1:-1])
+        if number:
+            return ("value", float(number))
+        if not name:
+            raise ValueError(f"unexpected {other!r} in formula {text!r}")
+        expect("(")
+        arguments = []
+        while tokens[position][4] != ")":
+            arguments.append(expression())
+            if tokens[position][4] == ",":
+                position += 1
+        expect(")")
+        return (name, *arguments)
+
+    def expression():
+        nonlocal position
+        left = term()
+        if position < len(tokens) and tokens[position][4] == "=":
+            position += 1
+            return ("=", left, term())
+        return left
+
+    tree = expression()
+    if position != len(tokens):
+        raise ValueError(f"trailing input in formula {text!r}")
+    return tree
+
+
+def _moment(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    moment = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return moment if moment.tzinfo else moment.replace(tzinfo=datetime.timezone.utc)
+
+
+def evaluate_formula(node, fields, modified):
+    """Evaluate a parse_formula() tree for a record's fields and last-modified Unix time."""
+    function, *arguments = node
+    if function == "field":
+        value = fields.get(arguments[0])
+        return None if value in ("", []) else value
+    if function == "value":
+        return arguments[0]
+    values = [evaluate_formula(argument, fields, modified) for argument in arguments]
+    if function == "=":
+        return values[0] == values[1]
+    if function == "OR":
+        return any(values)
+    if function == "AND":
+        return all(values)
+    if function == "BLANK":
+        return None
+    if function == "TODAY":
+        return datetime.datetime.now(datetime.timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    if function == "LAST_MODIFIED_TIME":
+        return datetime.datetime.fromtimestamp(modified, datetime.timezone.utc)
+    if function == "DATETIME_PARSE":
+        return _moment(values[0])
+    if function == "DATEADD":
+        return _moment(values[0]) + datetime.timedelta(**{values[2]: values[1]})
+    if function in ("IS_BEFORE", "IS_AFTER"):
+        first, second = _moment(values[0]), _moment(values[1])
+        if first is None or second is None:
+            return False
+        return first < second if function == "IS_BEFORE" else first > second
+    raise ValueError(f"formula function {function} is not supported by the stand-in")
+
+
+class AirtableTable:
+    """In-memory Airtable table supporting list (with fields[], offset and the
+    filterByFormula formulas parse_formula() reads) and batch PATCH."""
+
+    def __init__(self, records):
+        self.lock = threading.Lock()
+        self.records = {record["id"]: record for record in records}
+        self.order = [record["id"] for record in records]
+        now = time.time()
+        self.modified = {record_id: now for record_id in self.order}
+
+    def __call__(self, method, path, body):
+        if method == "PATCH":
+            updates = json.loads(body)["records"]
+            if len(updates) > 10:
+                return _json(422, {"error": {"type": "INVALID_RECORDS"}})
+            with self.lock:
+                for update in updates:
+                    self.records[update["id"]]["fields"].update(update["fields"])
+                    self.modified[update["id"]] = time.time()
+            return _json(200, {"records": updates})
+
+        query = parse_qs(urlparse(path).query)
+        page_size = int(query.get("pageSize", ["100"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        fields = query.get("fields[]")
+        formula = query.get("filterByFormula")
+        formula = parse_formula(formula[0]) if formula else None
+        with self.lock:
+            order = self.order
+            if formula:
+                order = [record_id for record_id in order
+                         if evaluate_formula(formula, self.records[record_id]["fields"], self.modified[record_id])]
+            page = []
+            for record_id in order[offset:offset + page_size]:
+                record = self.records[record_id]
+                record_fields = record["fields"]
+                if fields:
+                    record_fields = {k: v for k, v in record_fields.items() if k in fields}
+                page.append({"id": record_id, "createdTime": record["createdTime"], "fields": dict(record_fields)})
+        data = {"records": page}
+        if offset + page_size < len(order):
+            data["offset"] = str(offset + page_size)
+        return _json(200, data)
+
+
+def start_all(records, latency=0.0, error_rate=0.0, airtable_rate_limit=5, retry_after=1):
+    """Start every stand-in and return ({name: StubServer}, env vars pointing the scripts at them)."""
+    servers = {
+        "google": StubServer("google", google_handler, latency, error_rate),
+        "njparcels": StubServer("njparcels", njparcels_handler, latency, error_rate),
+        "taxsite": StubServer("taxsite", TaxSite(), latency * 4, error_rate),
+        "airtable": StubServer("airtable", AirtableTable(records), latency, error_rate,
+                               rate_limit=airtable_rate_limit, retry_after=retry_after),
+    }
+    for server in servers.values():
+        server.start()
+    env = {
+        "GOOGLE_GEOCODE_URL": f"{servers['google'].url}/maps/api/geocode/json",
+        "NJPARCELS_URL": f"{servers['njparcels'].url}/api/v1.0/property",
+        "TAX_SITE_URL": servers["taxsite"].url,
+        "AIRTABLE_API_URL": f"{servers['airtable'].url}/v0",
+        "AIRTABLE_BASE_ID": "appBENCH",
+        "AIRTABLE_API_KEY": "keyBENCH",
+        "GOOGLE_API_KEY": "bench",
+    }
+    return servers, env
@@ -0,0 +1,294 @@
+"""Small pure-Python helpers for the parcel geometry stored in the Vacants `geojson` field.
+
+The field holds either the full njparcels response (the original format) or a
+compact encoding from encode_geometry(); decode_geometry() and everything else
+here read all of them.
+"""
+import re
+import json
+
+# Prefix of polyline-encoded geometries, followed by the coordinate precision,
+# e.g. "pl6:Polygon:<ring>,<ring>"
+POLYLINE_PREFIX = "pl"
+POLYLINE_HEADER = re.compile(rf"^{POLYLINE_PREFIX}(\d+):(Point|Polygon|MultiPolygon):")
+
+
+def extract_geometry(data):
+    """Return the GeoJSON geometry inside an njparcels response, Feature, FeatureCollection,
+    bare geometry or JSON string of any of these; None if there is none."""
+    if isinstance(data, str):
+        if POLYLINE_HEADER.match(data):
+            try:
+                return decode_polyline_geometry(data)
+            except (ValueError, IndexError):
+                return None
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return None
+    if not isinstance(data, dict):
+        return None
+    if data.get("type") == "FeatureCollection":
+        for feature in data.get("features", []):
+            geometry = extract_geometry(feature)
+            if geometry:
+                return geometry
+        return None
+    if "coordinates" in data and data.get("type"):
+        return data
+    if "geometry" in data:
+        return extract_geometry(data["geometry"])
+    return None
+
+
+def _polygons(geometry):
+    """List the polygons (each a list of rings) in a Polygon or MultiPolygon."""
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return list(geometry["coordinates"])
+    return []
+
+
+def _ring_area_centroid(ring):
+    """Signed area and centroid of a closed ring (shoelace formula)."""
+    # Work relative to the first vertex: with raw lng/lat the cross products of
+    # a parcel-sized ring cancel catastrophically
+    ox, oy = ring[0][0], ring[0][1]
+    area = cx = cy = 0.0
+    for (x0, y0, *_), (x1, y1, *_) in zip(ring, ring[1:]):
+        x0, y0, x1, y1 = x0 - ox, y0 - oy, x1 - ox, y1 - oy
+        cross = x0 * y1 - x1 * y0
+        area += cross
+        cx += (x0 + x1) * cross
+        cy += (y0 + y1) * cross
+    area /= 2
+    if area == 0:
+        xs, ys = [p[0] for p in ring], [p[1] for p in ring]
+        return 0.0, (sum(xs) / len(xs), sum(ys) / len(ys))
+    return area, (ox + cx / (6 * area), oy + cy / (6 * area))
+
+
+def _polygon_area_centroid(rings):
+    """Area and centroid of a polygon with holes."""
+    total = sx = sy = 0.0
+    for i, ring in enumerate(rings):
+        area, (x, y) = _ring_area_centroid(ring)
+        area = abs(area) if i == 0 else -abs(area)
+        total += area
+        sx += x * area
+        sy += y * area
+    if total == 0:
+        return 0.0, _ring_area_centroid(rings[0])[1]
+    return total, (sx / total, sy / total)
+
+
+def _in_ring(x, y, ring):
+    inside = False
+    for (x0, y0, *_), (x1, y1, *_) in zip(ring, ring[1:]):
+        if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+            inside = not inside
+    return inside
+
+
+def _in_polygon(x, y, rings):
+    return _in_ring(x, y, rings[0]) and not any(_in_ring(x, y, hole) for hole in rings[1:])
+
+
+def _point_on_surface(rings):
+    """A point guaranteed inside the polygon: the middle of the widest interior span
+    along the horizontal line through the middle of its bounding box."""
+    ys = [p[1] for p in rings[0]]
+    y = (min(ys) + max(ys)) / 2
+    crossings = []
+    for ring in rings:
+        for (x0, y0, *_), (x1, y1, *_) in zip(ring, ring[1:]):
+            if (y0 > y) != (y1 > y):
+                crossings.append(x0 + (y - y0) * (x1 - x0) / (y1 - y0))
+    crossings.sort()
+    spans = list(zip(crossings[::2], crossings[1::2]))
+    if not spans:
+        return _ring_area_centroid(rings[0])[1]
+    left, right = max(spans, key=lambda span: span[1] - span[0])
+    return (left + right) / 2, y
+
+
+def representative_point(geometry):
+    """Return a (lng, lat) point for a GeoJSON geometry, or None.
+
+    For polygons this is the centroid of the largest polygon when it falls inside
+    it, and otherwise a point on its surface, so the point always lies on the parcel.
+    """
+    geometry = extract_geometry(geometry)
+    if not geometry:
+        return None
+    if geometry["type"] == "Point":
+        return tuple(geometry["coordinates"][:2])
+    polygons = [rings for rings in _polygons(geometry) if rings and len(rings[0]) >= 4]
+    if not polygons:
+        return None
+    rings = max(polygons, key=lambda rings: abs(_polygon_area_centroid(rings)[0]))
+    _, (x, y) = _polygon_area_centroid(rings)
+    if _in_polygon(x, y, rings):
+        return x, y
+    return _point_on_surface(rings)
+
+
+def bounds(geometry):
+    """Return (min_lng, min_lat, max_lng, max_lat) of a Point, Polygon or MultiPolygon, or None."""
+    if geometry["type"] == "Point":
+        points = [geometry["coordinates"]]
+    else:
+        points = [point for rings in _polygons(geometry) for ring in rings for point in ring]
+    if not points:
+        return None
+    xs, ys = [point[0] for point in points], [point[1] for point in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _perpendicular_distance(point, start, end):
+    (x, y), (x0, y0), (x1, y1) = point, start, end
+    dx, dy = x1 - x0, y1 - y0
+    if dx == 0 and dy == 0:
+        return ((x - x0) ** 2 + (y - y0) ** 2) ** 0.5
+    return abs(dy * x - dx * y + x1 * y0 - y1 * x0) / (dx * dx + dy * dy) ** 0.5
+
+
+def simplify_line(points, tolerance):
+    """Douglas-Peucker simplification keeping the end points."""
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        index, furthest = None, tolerance
+        for i in range(first + 1, last):
+            distance = _perpendicular_distance(points[i], points[first], points[last])
+            if distance > furthest:
+                index, furthest = i, distance
+        if index is not None:
+            keep[index] = True
+            stack.extend([(first, index), (index, last)])
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplify_ring(ring, tolerance):
+    """Simplify a closed ring, never dropping below a triangle."""
+    if len(ring) <= 4 or tolerance <= 0:
+        return list(ring)
+    # Split at the vertex furthest from the start so the closing point is kept
+    far = max(range(len(ring)), key=lambda i: (ring[i][0] - ring[0][0]) ** 2 + (ring[i][1] - ring[0][1]) ** 2)
+    simplified = simplify_line(ring[:far + 1], tolerance)[:-1] + simplify_line(ring[far:], tolerance)
+    return simplified if len(simplified) >= 4 else list(ring)
+
+
+def _map_rings(geometry, func):
+    if geometry["type"] == "Polygon":
+        return {"type": "Polygon", "coordinates": [func(ring) for ring in geometry["coordinates"]]}
+    if geometry["type"] == "MultiPolygon":
+        return {"type": "MultiPolygon",
+                "coordinates": [[func(ring) for ring in rings] for rings in geometry["coordinates"]]}
+    if geometry["type"] == "Point":
+        return {"type": "Point", "coordinates": func([geometry["coordinates"]])[0]}
+    raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+
+
+def _encode_number(value):
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def encode_polyline(points, precision):
+    """Encode [x, y] points with Google's polyline algorithm (deltas of scaled integers)."""
+    factor = 10 ** precision
+    out = []
+    px = py = 0
+    for x, y in points:
+        ix, iy = round(x * factor), round(y * factor)
+        out.append(_encode_number(ix - px) + _encode_number(iy - py))
+        px, py = ix, iy
+    return "".join(out)
+
+
+def decode_polyline(text, precision):
+    """Inverse of encode_polyline."""
+    factor = 10 ** precision
+    values = []
+    value = shift = 0
+    for char in text:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    points = []
+    x = y = 0
+    for dx, dy in zip(values[::2], values[1::2]):
+        x, y = x + dx, y + dy
+        points.append([x / factor, y / factor])
+    return points
+
+
+def encode_geometry(data, encoding="polyline", precision=6, tolerance=0.0):
+    """Encode just the geometry of an njparcels response (or any GeoJSON) compactly.
+
+    Coordinates are rounded to `precision` decimals (6 is about 10cm) and rings
+    are simplified with Douglas-Peucker at `tolerance` degrees (0 keeps every
+    vertex). With encoding="json" the result is minified GeoJSON; with
+    "polyline" each ring is delta-encoded with the polyline algorithm, rings
+    separated by "," and polygons by " ". Returns None if there is no geometry.
+    """
+    geometry = extract_geometry(data)
+    if not geometry:
+        return None
+
+    def compact(ring):
+        ring = simplify_ring(ring, tolerance) if len(ring) > 1 else ring
+        return [[round(x, precision), round(y, precision)] for x, y, *_ in ring]
+
+    geometry = _map_rings(geometry, compact)
+    if encoding == "json":
+        return json.dumps(geometry, separators=(",", ":"))
+    if encoding != "polyline":
+        raise ValueError(f"Unknown geometry encoding: {encoding}")
+
+    header = f"{POLYLINE_PREFIX}{precision}:{geometry['type']}:"
+    if geometry["type"] == "Point":
+        return header + encode_polyline([geometry["coordinates"]], precision)
+    polygons = geometry["coordinates"] if geometry["type"] == "MultiPolygon" else [geometry["coordinates"]]
+    return header + " ".join(",".join(encode_polyline(ring, precision) for ring in rings) for rings in polygons)
+
+
+def decode_polyline_geometry(text):
+    """Decode an encode_geometry(..., encoding="polyline") string to a GeoJSON geometry.
+
+    Raises ValueError if the string is not one.
+    """
+    header = POLYLINE_HEADER.match(text)
+    if not header:
+        raise ValueError(f"Not a polyline geometry: {text[:40]!r}")
+    precision, kind, body = int(header.group(1)), header.group(2), text[header.end():]
+    if kind == "Point":
+        points = decode_polyline(body, precision)
+        if len(points) != 1:
+            raise ValueError(f"Malformed polyline point: {body!r}")
+        return {"type": "Point", "coordinates": points[0]}
+    polygons = [[decode_polyline(ring, precision) for ring in rings.split(",")] for rings in body.split(" ")]
+    if not all(ring for rings in polygons for ring in rings):
+        raise ValueError(f"Malformed polyline {kind}: empty ring")
+    if kind == "Polygon":
+        return {"type": "Polygon", "coordinates": polygons[0]}
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def decode_geometry(value):
+    """Return the GeoJSON geometry stored in a `geojson` field, whichever format it is in."""
+    return extract_geometry(value)
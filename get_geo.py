@@ -1,10 +1,20 @@
 import os
-import requests
 import time
+import argparse
 import json
-from pyairtable import Api
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+import upstream
+import metrics
+from airtable_io import (AirtableWriteBuffer, report_failures, missing_formula,
+                         iter_records, table_url, auth_headers)
+from run_journal import RunJournal
+from geometry import representative_point, encode_geometry
+from lookup_cache import LookupCache
+from property_key import PropertyIndex, property_key
+from mirror import synced_records, missing_clause
+
 # Load environment variables
 load_dotenv()
 
@@ -13,36 +23,82 @@ AIRTABLE_API_KEY = os.getenv('AIRTABLE_API_KEY')
 AIRTABLE_BASE_ID = os.getenv('AIRTABLE_BASE_ID')
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 
-# Initialize Airtable client
-airtable = Api(AIRTABLE_API_KEY)
-table = airtable.table(AIRTABLE_BASE_ID, 'Vacants')
+# Upstream endpoints, overridable to point at local stand-ins (see benchmarks/)
+GOOGLE_GEOCODE_URL = os.getenv('GOOGLE_GEOCODE_URL', "https://maps.googleapis.com/maps/api/geocode/json")
+NJPARCELS_URL = os.getenv('NJPARCELS_URL', "https://njparcels.com/api/v1.0/property")
+
+# Number of records processed at once; each upstream service is still capped
+# by its own limits in upstream.SERVICES
+GEO_WORKERS = int(os.getenv('GEO_WORKERS', '16'))
+
+# Airtable REST endpoint for the Vacants table
+AIRTABLE_URL = table_url(AIRTABLE_BASE_ID, 'Vacants')
+HEADERS = auth_headers(AIRTABLE_API_KEY)
+
+# Only the fields process_record looks at are downloaded
+GEO_FIELDS = ['Address', 'Block', 'Lot', 'lat', 'lng', 'geojson']
+
+# How the parcel is stored in the geojson field: 'raw' keeps the whole njparcels
+# response, 'json' or 'polyline' keep only the geometry (see geometry.encode_geometry)
+GEOJSON_FORMAT = os.getenv('GEOJSON_FORMAT', 'raw')
+GEOJSON_PRECISION = int(os.getenv('GEOJSON_PRECISION', '6'))
+# Douglas-Peucker tolerance in degrees; 0 keeps every vertex
+GEOJSON_TOLERANCE = float(os.getenv('GEOJSON_TOLERANCE', '0'))
+
+# Local cache of Google and njparcels responses, shared across runs and keyed on
+# the canonical property key, so "12.00" and "12" or "ACADEMY STREET" and
+# "Academy St" share an entry
+cache = LookupCache()
 
+@metrics.timed('geocode_address')
 def geocode_address(address):
     """Geocode an address using Google Maps API"""
-    full_address = f"{address}, Jersey City, NJ"
-    url = f"https://maps.googleapis.com/maps/api/geocode/json?address={full_address}&key={GOOGLE_API_KEY}"
+    # Addresses such as "-" have no key and are not cached
+    cache_key = property_key(address)
+    cached = cache.get('geocode', cache_key) if cache_key else None
+    if cached:
+        return cached
     
-    response = requests.get(url)
+    full_address = f"{address}, Jersey City, NJ"
+    response = upstream.get('google', GOOGLE_GEOCODE_URL, params={'address': full_address, 'key': GOOGLE_API_KEY})
     data = response.json()
     
     if data['status'] == 'OK':
         location = data['results'][0]['geometry']['location']
-        return {
+        result = {
             'lat': location['lat'],
             'lng': location['lng']
         }
+        if cache_key:
+            cache.set('geocode', cache_key, result)
+        return result
     else:
         print(f"Geocoding error for {address}: {data['status']}")
         return None
 
+def geojson_field(geojson_data):
+    """Serialize an njparcels response for the geojson field in GEOJSON_FORMAT."""
+    if GEOJSON_FORMAT == 'raw':
+        return json.dumps(geojson_data)
+    return encode_geometry(geojson_data, GEOJSON_FORMAT, GEOJSON_PRECISION, GEOJSON_TOLERANCE)
+
+@metrics.timed('get_geojson')
 def get_geojson(block, lot):
     """Fetch GeoJSON data from NJ Parcels API"""
-    url = f"https://njparcels.com/api/v1.0/property/0906_{block}_{lot}.json"
+    cache_key = property_key(block=block, lot=lot)
+    cached = cache.get('parcel', cache_key) if cache_key else None
+    if cached:
+        return cached
+    
+    url = f"{NJPARCELS_URL}/0906_{block}_{lot}.json"
     
     try:
-        response = requests.get(url)
+        response = upstream.get('njparcels', url)
         if response.status_code == 200:
-            return response.json()
+            data = response.json()
+            if cache_key:
+                cache.set('parcel', cache_key, data)
+            return data
         else:
             print(f"Error fetching GeoJSON for Block {block}, Lot {lot}: Status code {response.status_code}")
             return None
@@ -50,63 +106,165 @@ def get_geojson(block, lot):
         print(f"Exception fetching GeoJSON for Block {block}, Lot {lot}: {str(e)}")
         return None
 
-def main():
-    # Get all records from the Vacants table
-    records = table.all()
-    print(f"Found {len(records)} records in Vacants table")
+def locate(address, geojson=None):
+    """Return lat/lng for a record, taken from its parcel geometry when it has one
+    and geocoded from the street address with Google otherwise."""
+    point = representative_point(geojson) if geojson else None
+    if point:
+        print(f"Using parcel geometry for {address}")
+        return {'lat': point[1], 'lng': point[0]}
+    if not address:
+        return None
+    print(f"Geocoding address for {address}")
+    return geocode_address(address)
+
+@metrics.timed('get_airtable_records')
+def get_airtable_records(formula=None):
+    """Retrieve the Vacants records matching formula (all if None), with only GEO_FIELDS."""
+    return list(iter_records(AIRTABLE_URL, HEADERS, formula=formula, fields=GEO_FIELDS))
+
+def process_record(record, writer, journal, known=None):
+    """Fetch GeoJSON and lat/lng for one record, then queue any updates for writing.
+
+    `known` holds the geojson and location already found for this property
+    (see process_property); they are reused instead of fetched again.
+    """
+    known = {} if known is None else known
+    record_id = record['id']
+    fields = record['fields']
     
-    for record in records:
-        record_id = record['id']
-        fields = record['fields']
-        
-        address = fields.get('Address')
-        block = fields.get('Block')
-        lot = fields.get('Lot')
-        
-        if not address:
-            print(f"No address found for record {record_id}")
-            continue
-            
-        if not block or not lot:
-            print(f"No block or lot found for record {record_id}")
-            continue
-            
-        print(f"Processing: {address}, Block {block}, Lot {lot}")
+    address = fields.get('Address')
+    block = fields.get('Block')
+    lot = fields.get('Lot')
+    
+    if not address:
+        print(f"No address found for record {record_id}")
+        return
         
-        # Initialize updates dictionary
-        updates = {}
+    if not block or not lot:
+        print(f"No block or lot found for record {record_id}")
+        return
         
-        # Check if lat and lng are missing
-        if 'lat' not in fields or 'lng' not in fields:
-            print(f"Geocoding address for {address}")
-            geocode_data = geocode_address(address)
-            if geocode_data:
-                updates['lat'] = geocode_data['lat']
-                updates['lng'] = geocode_data['lng']
+    print(f"Processing: {address}, Block {block}, Lot {lot}")
+    
+    # Initialize updates dictionary
+    updates = {}
+    
+    # Check if geojson is missing
+    geojson = fields.get('geojson')
+    if 'geojson' not in fields:
+        if 'geojson' in known:
+            print(f"Reusing GeoJSON of the same property for {address}")
+            geojson = known['geojson']
         else:
-            print(f"Lat/lng already exists for {address}, skipping geocoding")
-            
-        # Check if geojson is missing
-        if 'geojson' not in fields:
             print(f"Fetching GeoJSON for Block {block}, Lot {lot}")
             geojson_data = get_geojson(block, lot)
-            if geojson_data:
-                updates['geojson'] = json.dumps(geojson_data)
+            geojson = known['geojson'] = geojson_field(geojson_data) if geojson_data else None
+        if geojson:
+            updates['geojson'] = geojson
+    else:
+        print(f"GeoJSON already exists for {address}, skipping")
+        
+    # Check if lat and lng are missing
+    if 'lat' not in fields or 'lng' not in fields:
+        if 'location' in known:
+            print(f"Reusing lat/lng of the same property for {address}")
+            location = known['location']
         else:
-            print(f"GeoJSON already exists for {address}, skipping")
-            
-        # Update the record only if we have updates to make
-        if updates:
+            location = known['location'] = locate(address, geojson)
+        if location:
+            updates['lat'] = location['lat']
+            updates['lng'] = location['lng']
+    else:
+        print(f"Lat/lng already exists for {address}, skipping geocoding")
+        
+    # Update the record only if we have updates to make
+    if updates:
+        writer.add(record_id, updates)
+        print(f"Queued update for {address} with: {', '.join(updates.keys())}")
+    else:
+        print(f"No updates needed for {address}")
+        journal.mark_done(record_id, 'geo')
+
+def process_property(records, writer, journal):
+    """Process every record of one property, fetching its parcel and location at most once
+    and reusing any the property's other records already have."""
+    known = {}
+    for record in records:
+        fields = record['fields']
+        if fields.get('geojson'):
+            known.setdefault('geojson', fields['geojson'])
+        if 'lat' in fields and 'lng' in fields:
+            known.setdefault('location', {'lat': fields['lat'], 'lng': fields['lng']})
+    for record in records:
+        process_record(record, writer, journal, known)
+
+def group_by_property(records):
+    """Group records by canonical property key; records without one stay on their own."""
+    index = PropertyIndex()
+    groups = []
+    for record in records:
+        fields = record['fields']
+        if index.add(record, fields.get('Address'), fields.get('Block'), fields.get('Lot')) is None:
+            groups.append([record])
+    return [observations for _, observations in index] + groups
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Add lat/lng and parcel GeoJSON to Vacants records")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only fetch records missing lat, lng or geojson")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip records finished by the previous, interrupted run")
+    parser.add_argument('--mirror', action='store_true',
+                        help="read records from the local mirror (synced first) instead of paging through Airtable")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    # Get records from the Vacants table, letting Airtable do the filtering in incremental mode
+    if args.mirror:
+        where = missing_clause('lat', 'lng', 'geojson') if args.incremental else None
+        records = synced_records(AIRTABLE_URL, HEADERS, fields=GEO_FIELDS, where=where)
+    else:
+        formula = missing_formula('lat', 'lng', 'geojson') if args.incremental else None
+        records = get_airtable_records(formula)
+    print(f"Found {len(records)} records in Vacants table")
+    
+    # Records are journaled once their update has been written, so --resume
+    # picks up where an interrupted run stopped
+    journal = RunJournal('get_geo', resume=args.resume)
+    if args.resume:
+        done = journal.completed('geo')
+        records = [record for record in records if record['id'] not in done]
+        print(f"Resuming: {len(done)} records already done, {len(records)} to go")
+    
+    # Rate limiting is handled per service by upstream, so records are
+    # processed concurrently instead of sleeping between them
+    start = time.monotonic()
+    writer = AirtableWriteBuffer(AIRTABLE_URL, HEADERS,
+                                 on_written=lambda ids: journal.mark_done(ids, 'geo'))
+    # Records of the same property are processed together so each parcel is
+    # fetched and geocoded once
+    groups = group_by_property(records)
+    print(f"{len(records)} records are {len(groups)} distinct properties")
+    with ThreadPoolExecutor(max_workers=GEO_WORKERS) as executor:
+        for future in [executor.submit(process_property, group, writer, journal) for group in groups]:
             try:
-                table.update(record_id, updates)
-                print(f"Updated record for {address} with: {', '.join(updates.keys())}")
+                future.result()
             except Exception as e:
-                print(f"Error updating record for {address}: {str(e)}")
-        else:
-            print(f"No updates needed for {address}")
-            
-        # Avoid rate limiting
-        time.sleep(1)
+                print(f"Error processing record: {str(e)}")
+    failed = writer.close()
+    journal.close()
+    elapsed = time.monotonic() - start
+    
+    rate = len(records) / elapsed if elapsed else 0.0
+    print(f"Processed {len(records)} records in {elapsed:.1f}s ({rate:.2f} records/sec)")
+    print(f"Lookup cache: {cache.summary()}")
+    print(f"Airtable writes: {writer.summary()}")
+    report_failures(failed)
+    metrics.write_reports('get_geo', {'records': len(records), 'records_per_second': round(rate, 3),
+                                      'failed_writes': len(failed)})
         
 if __name__ == "__main__":
     main()
@@ -1,10 +1,21 @@
 import os
-import requests
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
+import threading
 import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import datetime  # new import added for date logging
 
+import upstream
+import metrics
+from airtable_io import (AirtableWriteBuffer, report_failures, stale_formula,
+                         iter_records, table_url, auth_headers, changed_fields)
+from lookup_cache import LookupCache
+from tax_page import parse_tax_html
+from run_journal import RunJournal, FreshnessLog
+from mirror import synced_records, stale_clause
+from property_key import property_key, PropertyIndex
+
 # Load environment variables
 load_dotenv()
 
@@ -14,47 +25,135 @@ AIRTABLE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
 AIRTABLE_TABLE_NAME = "Vacants"
 
 # Set up Airtable API
-AIRTABLE_URL = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_NAME}"
-HEADERS = {
-    "Authorization": f"Bearer {AIRTABLE_API_KEY}",
-    "Content-Type": "application/json"
-}
+AIRTABLE_URL = table_url(AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME)
+HEADERS = auth_headers(AIRTABLE_API_KEY)
+
+# Tax site pages; the form is served from an arbitrary account's ViewPay page
+TAX_SITE_URL = os.getenv("TAX_SITE_URL", "http://taxes.cityofjerseycity.com")
+VIEWPAY_URL = f"{TAX_SITE_URL}/ViewPay"
+FORM_URL = f"{VIEWPAY_URL}?accountNumber=115998"
+
+# Fields tax_update_fields() writes; their current values are downloaded so
+# unchanged ones are not written again
+TAX_VALUE_FIELDS = ["Tax Account Status", "Tax Account URL", "Tax Account Error", "tax_account_no",
+                    "tax_balance", "tax_days"]
 
-def get_airtable_records():
-    """Retrieve all records from the Vacants table in Airtable."""
-    records = []
-    params = {"pageSize": 100}
+# Only the fields main() looks at are downloaded; the Vacants table uses the
+# plain "Block"/"Lot" names that find_block_lot checks first
+TAX_FIELDS = ["Block", "Lot"] + TAX_VALUE_FIELDS
+
+@metrics.timed("get_airtable_records")
+def get_airtable_records(formula=None, fields=None):
+    """Retrieve records from the Vacants table in Airtable.
     
-    while True:
-        response = requests.get(AIRTABLE_URL, headers=HEADERS, params=params)
-        response_data = response.json()
-        
-        if "records" in response_data:
-            records.extend(response_data["records"])
-        
-        if "offset" in response_data:
-            params["offset"] = response_data["offset"]
-        else:
-            break
+    formula is passed as filterByFormula so Airtable only returns matching records,
+    and fields limits which fields are returned for each record.
+    """
+    return list(iter_records(AIRTABLE_URL, HEADERS, formula=formula, fields=fields))
+
+class TaxSiteSessions:
+    """Remembers which of upstream's per-thread sessions have loaded the tax site's search form.
+
+    upstream keeps one session per worker thread, with its connections and
+    cookies, so the search form only has to be loaded once per session instead
+    of once per parcel.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self):
+        return upstream.get_session()
+
+    def prime(self):
+        """Load the search form once so the session carries the site's cookies.
+
+        Returns None on success, or the failing response.
+        """
+        session = self.get()
+        if getattr(self.local, "primed", None) is session:
+            return None
+        response = upstream.get("taxsite", FORM_URL, session=session)
+        if response.status_code != 200:
+            return response
+        self.local.primed = session
+        return None
+
+    def reset(self):
+        """Drop this thread's session, e.g. after the site expired it."""
+        upstream.reset_session()
+
+tax_sessions = TaxSiteSessions()
+
+# Block/lot -> account number, persisted so later runs can skip the search form.
+# Account numbers do not change, so they are kept in their own file and never
+# evicted by the geocode and parcel lookups
+TAX_ACCOUNTS_PATH = os.getenv("TAX_ACCOUNTS_PATH", ".cache/tax_accounts.sqlite")
+account_numbers = LookupCache(TAX_ACCOUNTS_PATH, max_entries=None)
+
+def account_url(account_number):
+    return f"{VIEWPAY_URL}?accountNumber={account_number}"
+
+def parse_tax_page(response, block_id, lot_id):
+    """Parse a ViewPay page into the tax_data dict returned by get_tax_account_info."""
+    if response.status_code != 200:
+        return {
+            "url": response.url,
+            "status": "Failed",
+            "error": f"Page load failed with HTTP Status: {response.status_code}"
+        }
+    
+    record = parse_tax_html(response.text)
+    
+    # Check if we got an error message
+    if record.errors is not None:
+        error_text = ', '.join(record.errors)
+        return {
+            "url": response.url,
+            "status": "Failed",
+            "error": f"Form submission returned errors: {error_text}"
+        }
+    
+    # Verify if we found the account info or got a no-results page
+    has_account = record.account_number is not None
     
-    return records
+    # Create the return data, including the submitted block/lot for verification
+    return {
+        "url": response.url,
+        "status": "Success" if has_account else "No Account Found",
+        "submitted_block": block_id,
+        "submitted_lot": lot_id,
+        **record.fields()
+    }
 
+@metrics.timed("get_tax_account_info")
 def get_tax_account_info(block_id, lot_id, qualifier=""):
-    """Scrape tax account information from Jersey City tax website using block and lot IDs."""
-    form_url = "http://taxes.cityofjerseycity.com/ViewPay?accountNumber=115998"
+    """Scrape tax account information from Jersey City tax website using block and lot IDs.
+
+    Parcels whose account number is already known are fetched with a single GET of
+    their ViewPay page; the rest go through the search form once and their account
+    number is remembered for next time.
+    """
+    key = property_key(block=block_id, lot=lot_id)
     
     try:
-        # Start a session to maintain cookies
-        session = requests.Session()
+        session = tax_sessions.get()
         
-        # Get the initial page
-        initial_response = session.get(form_url)
+        # Fast path: go straight to the account page
+        account_number = account_numbers.get("tax_account", key) if key else None
+        if account_number:
+            response = upstream.get("taxsite", account_url(account_number), session=session)
+            tax_data = parse_tax_page(response, block_id, lot_id)
+            if tax_data.get("account_number") == account_number:
+                return tax_data
         
-        if initial_response.status_code != 200:
+        # Load the form page once per session to pick up its cookies
+        failed = tax_sessions.prime()
+        if failed is not None:
             return {
-                "url": form_url,
+                "url": FORM_URL,
                 "status": "Failed",
-                "error": f"Initial page load failed with HTTP Status: {initial_response.status_code}"
+                "error": f"Initial page load failed with HTTP Status: {failed.status_code}"
             }
         
         # Revert form data: Reinstate "CurrentAccountNumber" and remove "sAccountNumber"
@@ -71,132 +170,19 @@ def get_tax_account_info(block_id, lot_id, qualifier=""):
         }
         
         # Submit the form
-        response = session.post(form_url, data=form_data)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Check if we got a valid response
-        if response.status_code == 200:
-            account_data = {
-                # Store the submitted block/lot for verification
-                "submitted_block": block_id,
-                "submitted_lot": lot_id
-            }
-            
-            # Look for account information
-            account_info = soup.find('input', {'id': 'sAccountNumber'})
-            if account_info and account_info.get('value'):
-                account_data["account_number"] = account_info.get('value')
-            
-            # Extract the Account# and other data from the response
-            account_rows = soup.find_all('div', class_='row')
-            for row in account_rows:
-                # Account number extraction (backup method)
-                if not account_data.get("account_number") and row.find('div', string=lambda text: text and 'Account#:' in text):
-                    account_div = row.find('div', class_='col-md-2')
-                    if account_div and account_div.find('span', class_='red'):
-                        account_number = account_div.find('span', class_='red').get_text(strip=True)
-                        account_data["account_number"] = account_number
-                
-                # Property location extraction
-                if row.find('div', string=lambda text: text and 'Location:' in text):
-                    location_div = row.find('div', class_='col-md-2')
-                    if location_div and location_div.find('span', class_='red'):
-                        location = location_div.find('span', class_='red').get_text(strip=True)
-                        account_data["location"] = location
-                
-                # Extract address
-                if row.find('div', string=lambda text: text and 'Address:' in text):
-                    address_div = row.find('div', class_='col-md-2')
-                    if address_div and address_div.find('span', class_='red'):
-                        address = address_div.find('span', class_='red').get_text(strip=True)
-                        account_data["address"] = address
-                
-                # Extract City/State
-                if row.find('div', string=lambda text: text and 'City/State:' in text):
-                    city_div = row.find('div', class_='col-md-2')
-                    if city_div and city_div.find('span', class_='red'):
-                        city_state = city_div.find('span', class_='red').get_text(strip=True)
-                        account_data["city_state"] = city_state
-                
-                # Extract financial amounts
-                if row.find('div', string=lambda text: text and 'Principal:' in text):
-                    amount_div = row.find('div', class_='col-md-1', style="text-align:right")
-                    if amount_div and amount_div.find('span', class_='red'):
-                        principal = amount_div.find('span', class_='red').get_text(strip=True)
-                        account_data["principal"] = principal
-                
-                if row.find('div', string=lambda text: text and 'Total:' in text):
-                    total_div = row.find('div', class_='col-md-1', style="text-align:right")
-                    if total_div and total_div.find('span', class_='red'):
-                        total = total_div.find('span', class_='red').get_text(strip=True)
-                        account_data["total"] = total
-            
-            # Check if we got an error message
-            error_messages = soup.find('div', {'class': 'validation-summary-errors'})
-            if error_messages:
-                errors = [li.text for li in error_messages.find_all('li')]
-                error_text = ', '.join(errors)
-                return {
-                    "url": response.url,
-                    "status": "Failed",
-                    "error": f"Form submission returned errors: {error_text}"
-                }
-            
-            # New: Set tax_balance to total from account_data (if available) and convert to float
-            if "total" in account_data:
-                total_str = account_data["total"]
-                # Remove currency symbols and commas
-                total_str = total_str.replace("$", "").replace(",", "")
-                try:
-                    account_data["tax_balance"] = float(total_str)
-                except ValueError:
-                    account_data["tax_balance"] = total_str
-            
-            # Verify if we found the account info or got a no-results page
-            has_account = "account_number" in account_data
-            
-            # Create the return data
-            tax_data = {
-                "url": response.url,
-                "status": "Success" if has_account else "No Account Found",
-                **account_data  # Include all the extracted data
-            }
-            
-            return tax_data
-        else:
-            return {
-                "url": form_url,
-                "status": "Failed",
-                "error": f"Form submission failed with HTTP Status: {response.status_code}"
-            }
+        response = upstream.post("taxsite", FORM_URL, session=session, data=form_data)
+        tax_data = parse_tax_page(response, block_id, lot_id)
+        if key and tax_data.get("account_number"):
+            account_numbers.set("tax_account", key, tax_data["account_number"])
+        return tax_data
     except Exception as e:
+        tax_sessions.reset()
         return {
-            "url": form_url,
+            "url": FORM_URL,
             "status": "Error",
             "error": str(e)
         }
 
-def update_airtable_record(record_id, fields):
-    """Update an Airtable record with new information."""
-    update_url = f"{AIRTABLE_URL}/{record_id}"
-    payload = {"fields": fields}
-    
-    try:
-        print(f"Updating Airtable record {record_id} with fields: {fields}")
-        response = requests.patch(update_url, headers=HEADERS, json=payload)
-        
-        # Check if the request was successful
-        if response.status_code == 200:
-            print(f"Successfully updated record {record_id}")
-            return response.json()
-        else:
-            print(f"ERROR: Failed to update record {record_id}. Status code: {response.status_code}")
-            print(f"Response text: {response.text}")
-            return {"error": f"Failed to update: {response.status_code}", "details": response.text}
-    except Exception as e:
-        print(f"EXCEPTION during Airtable update: {str(e)}")
-        return {"error": f"Exception: {str(e)}"}
-
 def find_block_lot(fields):
     """Try to find the block and lot fields in the record."""
     block = None
@@ -218,62 +204,167 @@ def find_block_lot(fields):
     
     return block, lot
 
-def main():
-    # Get all records from Airtable
-    records = get_airtable_records()
-    print(f"Retrieved {len(records)} records from Airtable")
+def tax_update_fields(tax_info):
+    """Build the Airtable fields to write for a get_tax_account_info result."""
+    # Update Airtable record with the tax information
+    update_fields = {
+        "Tax Account Status": tax_info["status"]
+    }
+    if "account_number" in tax_info and tax_info["account_number"]:
+        update_fields["Tax Account URL"] = account_url(tax_info["account_number"])
+    else:
+        update_fields["Tax Account URL"] = tax_info["url"]
     
-    for record in records:
-        record_id = record["id"]
-        fields = record["fields"]
-        
-        # Find the block and lot numbers
-        block_id, lot_id = find_block_lot(fields)
+    # If account number was found, add it to the update
+    if "account_number" in tax_info and tax_info["account_number"]:
+        update_fields["tax_account_no"] = tax_info["account_number"]
+    
+    if tax_info["status"] != "Success":
+        update_fields["Tax Account Error"] = tax_info.get("error", "Unknown error")
+    
+    # New: Log the current date in YYYY-MM-DD ISO format in "tax_updated"
+    update_fields["tax_updated"] = datetime.date.today().isoformat()
+    
+    # New: Include tax_balance and tax_days if available
+    if "tax_balance" in tax_info:
+        update_fields["tax_balance"] = tax_info["tax_balance"]
+    if "tax_days" in tax_info:
+        update_fields["tax_days"] = tax_info["tax_days"]
+    
+    return update_fields
+
+def process_record(record, writer, journal=None, freshness=None, tax_info=None):
+    """Scrape the tax account for one record and queue the fields that changed.
+
+    Returns True if an update was queued. A record whose values are unchanged is
+    not written; it is marked done in the journal and checked in `freshness` instead.
+    If `tax_info` is given (scraped for another record of the property) it is used as is.
+    """
+    record_id = record["id"]
+    fields = record["fields"]
+    
+    # Find the block and lot numbers
+    block_id, lot_id = find_block_lot(fields)
+    
+    if block_id and lot_id:
+        print(f"Processing Block: {block_id}, Lot: {lot_id}")
         
-        if block_id and lot_id:
-            print(f"Processing Block: {block_id}, Lot: {lot_id}")
-            
-            # Get tax account information
+        # Get tax account information
+        if tax_info is None:
             tax_info = get_tax_account_info(block_id, lot_id)
-            
-            # Update Airtable record with the tax information
-            update_fields = {
-                "Tax Account Status": tax_info["status"]
-            }
-            if "account_number" in tax_info and tax_info["account_number"]:
-                update_fields["Tax Account URL"] = f"http://taxes.cityofjerseycity.com/ViewPay?accountNumber={tax_info['account_number']}"
-            else:
-                update_fields["Tax Account URL"] = tax_info["url"]
-            
-            # If account number was found, add it to the update
-            if "account_number" in tax_info and tax_info["account_number"]:
-                update_fields["tax_account_no"] = tax_info["account_number"]
-            
-            if tax_info["status"] != "Success":
-                update_fields["Tax Account Error"] = tax_info.get("error", "Unknown error")
-                
-            # New: Log the current date in YYYY-MM-DD ISO format in "tax_updated"
-            update_fields["tax_updated"] = datetime.date.today().isoformat()
-            
-            # New: Include tax_balance and tax_days if available
-            if "tax_balance" in tax_info:
-                update_fields["tax_balance"] = tax_info["tax_balance"]
-            if "tax_days" in tax_info:
-                update_fields["tax_days"] = tax_info["tax_days"]
-            
-            # Update the record in Airtable
-            update_result = update_airtable_record(record_id, update_fields)
-            
-            # Check if the update was successful
-            if "error" in update_result:
-                print(f"Failed to update record {record_id}: {update_result.get('error')}")
-            else:
-                print(f"Successfully updated record {record_id}")
-            
-            # Add a delay to avoid hitting rate limits
-            time.sleep(1)
-        else:
-            print(f"No block/lot found for record {record_id}")
+        
+        update_fields = changed_fields(fields, tax_update_fields(tax_info))
+        if not update_fields:
+            print(f"Tax account unchanged for record {record_id}, not writing")
+            if journal:
+                journal.mark_done(record_id, "tax")
+            if freshness:
+                freshness.mark_checked(record_id, "tax")
+            return False
+        
+        # Queue the update for Airtable; tax site requests are paced by upstream
+        writer.add(record_id, update_fields)
+        print(f"Queued update for record {record_id}: {', '.join(update_fields)}")
+        return True
+    else:
+        print(f"No block/lot found for record {record_id}")
+    return False
+
+def process_property(records, writer, journal=None, freshness=None):
+    """Scrape the tax account once for records of the same property and update each.
+
+    Returns how many updates were queued.
+    """
+    block_id, lot_id = find_block_lot(records[0]["fields"])
+    tax_info = get_tax_account_info(block_id, lot_id) if block_id and lot_id else None
+    return sum(process_record(record, writer, journal, freshness, tax_info) for record in records)
+
+def group_by_property(records):
+    """Group records by canonical block/lot; records without one stay on their own."""
+    index = PropertyIndex()
+    groups = []
+    for record in records:
+        block_id, lot_id = find_block_lot(record["fields"])
+        if index.add(record, block=block_id, lot=lot_id) is None:
+            groups.append([record])
+    return [observations for _, observations in index] + groups
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape tax account status for Vacants records")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only fetch records whose tax_updated is missing or stale")
+    parser.add_argument("--stale-days", type=int, default=30,
+                        help="age in days after which tax_updated counts as stale (default: 30)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip records finished by the previous, interrupted run")
+    parser.add_argument("--mirror", action="store_true",
+                        help="read records from the local mirror (synced first) instead of paging through Airtable")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    
+    # Get records from Airtable, letting Airtable do the filtering in incremental mode
+    if args.mirror:
+        where = stale_clause("tax_updated", args.stale_days) if args.incremental else None
+        records = synced_records(AIRTABLE_URL, HEADERS, fields=TAX_FIELDS, where=where)
+    else:
+        formula = stale_formula("tax_updated", args.stale_days) if args.incremental else None
+        records = get_airtable_records(formula=formula, fields=TAX_FIELDS)
+    print(f"Retrieved {len(records)} records from Airtable")
+    
+    # tax_updated is only written with a change, so when records were last
+    # checked is also kept locally
+    freshness = FreshnessLog()
+    if args.incremental:
+        recent = freshness.checked_since("tax", args.stale_days)
+        records = [record for record in records if record["id"] not in recent]
+        print(f"{len(records)} records not checked in the last {args.stale_days} days")
+    
+    # Records are journaled once their update has been written, so --resume
+    # picks up where an interrupted run stopped
+    journal = RunJournal("get_taxes", resume=args.resume)
+    if args.resume:
+        done = journal.completed("tax")
+        records = [record for record in records if record["id"] not in done]
+        print(f"Resuming: {len(done)} records already done, {len(records)} to go")
+    
+    # Updates are sent in batches of 10 from a background thread
+    def written(ids):
+        journal.mark_done(ids, "tax")
+        freshness.mark_checked(ids, "tax")
+    writer = AirtableWriteBuffer(AIRTABLE_URL, HEADERS, on_written=written)
+    
+    # Records are scraped in parallel; how many requests actually reach the tax
+    # site at once is decided by its AdaptiveLimiter, which is reported as it runs
+    tax_limiter = upstream.limiter("taxsite")
+    reporter = upstream.start_status_reporter(["taxsite"])
+    start = time.monotonic()
+    queued = 0
+    # Records of the same property share one scrape
+    groups = group_by_property(records)
+    print(f"{len(records)} records are {len(groups)} distinct properties")
+    with ThreadPoolExecutor(max_workers=tax_limiter.concurrency) as executor:
+        futures = [executor.submit(process_property, group, writer, journal, freshness) for group in groups]
+        for future in futures:
+            try:
+                queued += future.result()
+            except Exception as e:
+                print(f"Error processing record: {str(e)}")
+    reporter.set()
+    print(f"Tax site: {tax_limiter.status()}")
+    
+    failed = writer.close()
+    journal.close()
+    freshness.close()
+    elapsed = time.monotonic() - start
+    
+    rate = len(records) / elapsed if elapsed else 0.0
+    print(f"Processed {len(records)} records in {elapsed:.1f}s ({rate:.2f} records/sec)")
+    print(f"Airtable writes: {writer.summary()}, {len(records) - queued} records unchanged or skipped")
+    report_failures(failed)
+    metrics.write_reports("get_taxes", {"records": len(records), "records_per_second": round(rate, 3),
+                                        "updates_queued": queued, "failed_writes": len(failed)})
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,283 @@
+"""Parse the city's vacant/abandoned list files in data/ into one normalized table.
+
+Each kind of file is described declaratively in SOURCES: which files it
+covers, where its header row is, how its headers map onto the normalized
+COLUMNS and which type its rows are. Files are parsed in parallel worker
+processes and each parsed file is cached under its content hash, so adding a
+new list only costs parsing that one file.
+
+    python ingest.py [--output data/lists.csv] [--workers N]
+"""
+import os
+import re
+import glob
+import json
+import hashlib
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+DATA_DIR = os.getenv("INGEST_DATA_DIR", "data")
+INGEST_CACHE_DIR = os.getenv("INGEST_CACHE_DIR", ".cache/ingest")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 4)))
+
+# Bump to invalidate every cached parse after changing parse_file()
+PARSER_VERSION = 3
+
+# The normalized table, in column order; IDENTITY_COLUMNS tell copies of a list apart
+COLUMNS = [
+    "file", "row", "date", "type", "street_address", "number", "street", "block", "lot",
+    "owners_name", "owners_address", "lat", "lon", "registration_date", "paid_by",
+    "secured_date", "notes",
+]
+IDENTITY_COLUMNS = ["date", "type", "street_address", "block", "lot"]
+
+# Headers are matched after lowercasing and collapsing whitespace (see _header)
+SOURCES = [
+    {
+        "name": "apra",
+        "files": ["apraproperties*.xlsx", "publicofficersapralist*.xlsx"],
+        "columns": {"number": "number", "property address": "street", "block": "block", "lot": "lot",
+                    "owner's name": "owners_name", "owner's addresss": "owners_address",
+                    "comments": "notes"},
+        "type": "Abandoned",
+    },
+    {
+        "name": "inventory",
+        "files": ["vacantbuildinginventorylist*.xlsx"],
+        "header": 2,
+        "columns": {"number": "number", "street name": "street", "registration date": "registration_date",
+                    "paid by": "paid_by", "secured date": "secured_date"},
+        "type": "Vacant",
+    },
+    {
+        "name": "inventory-2018",
+        "files": ["vacantbuildinginventory2018.xlsx", "vacantbuildinginventory2018csv.csv"],
+        "columns": {"unnamed: 0": "number", "street name": "street", "registration date": "registration_date",
+                    "paid by": "paid_by", "secured date": "secured_date", "notes": "notes"},
+        "type": "Vacant",
+    },
+    {
+        # The open data portal export of the 2014 list, as a sheet and as CSV copies
+        "name": "odp",
+        "files": ["vacantbuildingslotslist2014.xlsx", "vacantbuildingslotslist2014csv.csv",
+                  "vacantbuildingsaprapropertiescsv201606.csv"],
+        "sheet": "ODP",
+        "columns": {"number": "number", "street name": "street", "streetaddress": "street_address",
+                    "latitude": "lat", "longidtude": "lon", "type": "type"},
+        "type_map": {"Vacant Building": "Vacant", "APRA": "Abandoned"},
+        "date": "2014-07-01",
+    },
+    {
+        # The city's PDF releases, and the CSVs tabula made from the December 2024 ones
+        "name": "building-list",
+        "files": ["*/VACANT BUILDING LIST.pdf", "*/tabula-VACANT BUILDING LIST.csv"],
+        "columns": {"vacant building address": "street_address", "block": "block", "lot": "lot",
+                    "contact company name": "owners_name"},
+        "type": "Vacant",
+    },
+    {
+        "name": "lot-list",
+        "files": ["*/VACANT LOT LIST.pdf", "*/tabula-VACANT LOT LIST.csv"],
+        "columns": {"vacant lot address": "street_address", "block": "block", "lot": "lot",
+                    "business name": "owners_name"},
+        "type": "Vacant Lot",
+    },
+]
+
+
+def _header(name):
+    return " ".join(str(name).lower().split())
+
+
+def _text(value):
+    """Strip a cell to a string, rendering integral floats (block 25601.0) without the .0."""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime("%Y-%m-%d")
+    text = " ".join(str(value).split())
+    return text or None
+
+
+def _date_text(text):
+    """ISO date for a cell that is just a date (11/29/12, 2012-11-29); other text as is."""
+    if not isinstance(text, str):
+        return None
+    for fmt in ("%m/%d/%y", "%m/%d/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(text, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+    return text
+
+
+def snapshot_date(path):
+    """The list's date from its file or directory name: 201607 -> 2016-07-01, 2024-12 -> 2024-12-01,
+    a bare year -> July 1st of it (the convention the 2021 study uses)."""
+    for part in reversed(path.replace("\\", "/").split("/")):
+        match = re.search(r"(20\d\d)-?(0[1-9]|1[0-2])?(?!\d)", part)
+        if match:
+            return f"{match.group(1)}-{match.group(2) or '07'}-01"
+    return None
+
+
+def source_for(path, data_dir=DATA_DIR):
+    """Return the SOURCES entry covering path, or None."""
+    relative = os.path.relpath(path, data_dir).replace("\\", "/")
+    for source in SOURCES:
+        if any(glob.fnmatch.fnmatch(relative, pattern) for pattern in source["files"]):
+            return source
+    return None
+
+
+def read_raw(path, source):
+    """Read a file's table as it is, with its own headers."""
+    header = source.get("header", 0)
+    if path.endswith(".pdf"):
+        # Only needed for the PDF releases, so pdfplumber stays optional
+        import pdf_extract
+        return pdf_extract.read_table(path, workers=1)
+    if path.endswith(".csv"):
+        return pd.read_csv(path, header=header, dtype=object, encoding="utf-8-sig")
+    sheet = source.get("sheet", 0)
+    if isinstance(sheet, str):
+        sheets = pd.ExcelFile(path).sheet_names
+        sheet = sheet if sheet in sheets else 0
+    return pd.read_excel(path, sheet_name=sheet, header=header, dtype=object)
+
+
+def parse_file(path, source):
+    """Parse one file with its SOURCES entry into a DataFrame with COLUMNS."""
+    return normalize(read_raw(path, source), path, source)
+
+
+def normalize(raw, path, source):
+    """Map a file's raw table (see read_raw) onto COLUMNS."""
+    header = 0 if path.endswith(".pdf") else source.get("header", 0)
+    headers = {_header(column): column for column in raw.columns}
+    missing = [name for name in source["columns"] if name not in headers]
+    if missing:
+        raise ValueError(f"{path}: no column {', '.join(missing)} (has {', '.join(headers)})")
+
+    table = pd.DataFrame({target: raw[headers[name]].map(_text) for name, target in source["columns"].items()})
+    table["row"] = raw.index + header + 2
+    for column in COLUMNS:
+        if column not in table:
+            table[column] = None
+
+    if "type_map" in source:
+        table["type"] = table["type"].map(source["type_map"])
+    else:
+        table["type"] = source["type"]
+    if table["street_address"].isna().all():
+        table["street_address"] = (table["number"].fillna("") + " " + table["street"].fillna("")).str.strip()
+    table["street_address"] = table["street_address"].replace("", None)
+    table = table[table["street_address"].notna() & table["type"].notna()]
+
+    table["file"] = os.path.basename(path)
+    table["date"] = source.get("date") or snapshot_date(path)
+    for column in ("registration_date", "paid_by", "secured_date"):
+        table[column] = table[column].map(_date_text)
+    for column in ("lat", "lon"):
+        table[column] = pd.to_numeric(table[column], errors="coerce").round(6)
+    return table[COLUMNS].reset_index(drop=True)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_key(path, source):
+    spec = json.dumps(source, sort_keys=True)
+    return hashlib.sha256(f"{PARSER_VERSION}|{file_hash(path)}|{spec}".encode()).hexdigest()
+
+
+def _parse_cached(path, source, cache_dir):
+    """Worker: parse path unless its content hash is cached; returns (path, table, cached)."""
+    cache_path = os.path.join(cache_dir, f"{_cache_key(path, source)}.pkl")
+    if os.path.exists(cache_path):
+        table = pd.read_pickle(cache_path)
+        table["file"] = os.path.basename(path)
+        return path, table, True
+    table = parse_file(path, source)
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    table.to_pickle(tmp)
+    os.replace(tmp, cache_path)
+    return path, table, False
+
+
+def list_files(data_dir=DATA_DIR):
+    """Every file under data_dir that a SOURCES entry covers, with that entry."""
+    files = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "**", "*"), recursive=True)):
+        source = source_for(path, data_dir) if os.path.isfile(path) else None
+        if source:
+            files.append((path, source))
+    return files
+
+
+def ingest(data_dir=DATA_DIR, cache_dir=INGEST_CACHE_DIR, workers=INGEST_WORKERS):
+    """Parse every covered file (in parallel, cached) and return the normalized table.
+
+    A file listing the same properties as an earlier file for the same date
+    (an xlsx list or PDF and its CSV export) is only included once.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    files = list_files(data_dir)
+    results = {}
+    parsed = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(files)))) as pool:
+        futures = [pool.submit(_parse_cached, path, source, cache_dir) for path, source in files]
+        for future in futures:
+            path, table, cached = future.result()
+            results[path] = table
+            parsed += not cached
+
+    frames = []
+    seen = set()
+    # Originals (spreadsheets, PDFs) first, so they are the copy kept over CSV exports
+    for path, _ in sorted(files, key=lambda item: (item[0].endswith(".csv"), item[0])):
+        table = results[path]
+        content = pd.util.hash_pandas_object(table[IDENTITY_COLUMNS].astype(str), index=False)
+        key = hashlib.sha256(content.values.tobytes()).hexdigest()
+        if key in seen:
+            print(f"Skipping {os.path.relpath(path, data_dir)}: same properties as an earlier file")
+            continue
+        seen.add(key)
+        frames.append(table)
+
+    print(f"Ingested {len(files)} files ({parsed} parsed, {len(files) - parsed} from cache)")
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.concat(frames, ignore_index=True).sort_values(["date", "file", "row"], kind="stable", ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Normalize the list files in data/ into one table")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--output", default=os.path.join(DATA_DIR, "lists.csv"),
+                        help="where to write the table (.csv or .parquet)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    args = parser.parse_args(argv)
+
+    table = ingest(args.data_dir, workers=args.workers)
+    if args.output.endswith(".parquet"):
+        table.to_parquet(args.output, index=False)
+    else:
+        table.to_csv(args.output, index=False)
+    counts = table.groupby(["date", "type"]).size()
+    print(counts.to_string())
+    print(f"Wrote {len(table)} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
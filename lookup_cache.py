@@ -0,0 +1,96 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+
+# Where cached lookups live and how big the cache may grow
+LOOKUP_CACHE_PATH = os.getenv("LOOKUP_CACHE_PATH", ".cache/lookups.sqlite")
+LOOKUP_CACHE_MAX_ENTRIES = int(os.getenv("LOOKUP_CACHE_MAX_ENTRIES", "200000"))
+
+# Time-to-live per source in seconds (None = never expires)
+DAY = 24 * 60 * 60
+SOURCE_TTL = {
+    "geocode": 180 * DAY,
+    "parcel": 90 * DAY,
+}
+
+
+class LookupCache:
+    """SQLite-backed key/value cache with per-source TTL and LRU eviction.
+
+    max_entries=None keeps every entry.
+    """
+
+    def __init__(self, path=LOOKUP_CACHE_PATH, max_entries=LOOKUP_CACHE_MAX_ENTRIES, ttl=None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = dict(SOURCE_TTL, **(ttl or {}))
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " source TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL,"
+            " PRIMARY KEY (source, key))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def _count(self, source, outcome):
+        counts = self.stats.setdefault(source, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def get(self, source, key):
+        """Return the cached value, or None on a miss or expired entry."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, created FROM cache WHERE source = ? AND key = ?", (source, key)
+            ).fetchone()
+            ttl = self.ttl.get(source)
+            if row is None or (ttl is not None and now - row[1] > ttl):
+                self._count(source, "misses")
+                return None
+            self.conn.execute(
+                "UPDATE cache SET accessed = ? WHERE source = ? AND key = ?", (now, source, key)
+            )
+            self.conn.commit()
+            self._count(source, "hits")
+            return json.loads(row[0])
+
+    def set(self, source, key, value):
+        """Store a JSON-serializable value, evicting least recently used entries if full."""
+        now = time.time()
+        with self.lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM cache WHERE source = ? AND key = ?", (source, key)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (source, key, value, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (source, key, json.dumps(value), now, now),
+            )
+            if not exists:
+                self.size += 1
+            excess = self.size - self.max_entries if self.max_entries is not None else 0
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache ORDER BY accessed LIMIT ?)",
+                    (excess,),
+                )
+                self.size -= excess
+            self.conn.commit()
+
+    def summary(self):
+        """Return a one-line hit/miss summary per source."""
+        parts = []
+        for source, counts in sorted(self.stats.items()):
+            total = counts["hits"] + counts["misses"]
+            rate = counts["hits"] / total * 100 if total else 0.0
+            parts.append(f"{source}: {counts['hits']} hits, {counts['misses']} misses ({rate:.0f}% hit rate)")
+        return "; ".join(parts) or "no lookups"
@@ -0,0 +1,183 @@
+"""In-process metrics for enrichment runs.
+
+upstream.request records every HTTP call (latency, status code, bytes) per
+service, the @timed decorator records per-function latency, and retries are
+counted where they happen. At the end of a run write_reports() writes:
+
+- a Prometheus textfile (for node_exporter's textfile collector) that is
+  replaced on every run, and
+- a timestamped JSON run summary, so runs can be graphed over time.
+"""
+import os
+import json
+import time
+import threading
+import functools
+
+METRICS_DIR = os.getenv("METRICS_DIR", ".cache/metrics")
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+# Samples kept per histogram for the percentiles in the JSON summary
+MAX_SAMPLES = 10000
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+
+    def summary(self):
+        ordered = sorted(self.samples)
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 4) if ordered else None
+
+        return {
+            "count": self.count,
+            "sum_seconds": round(self.sum, 4),
+            "mean_seconds": round(self.sum / self.count, 4) if self.count else None,
+            "p50_seconds": pct(50),
+            "p95_seconds": pct(95),
+            "max_seconds": round(ordered[-1], 4) if ordered else None,
+        }
+
+
+class Registry:
+    """Thread-safe store of the histograms and counters for one run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.request_latency = {}  # (service, method) -> Histogram
+        self.function_latency = {}  # function -> Histogram
+        self.status_codes = {}  # (service, status) -> count
+        self.retries = {}  # service -> count
+        self.bytes = {}  # (service, direction) -> count
+
+    def observe_request(self, service, method, latency, status, sent, received):
+        with self.lock:
+            self.request_latency.setdefault((service, method), Histogram()).observe(latency)
+            key = (service, str(status))
+            self.status_codes[key] = self.status_codes.get(key, 0) + 1
+            for direction, size in (("sent", sent), ("received", received)):
+                self.bytes[(service, direction)] = self.bytes.get((service, direction), 0) + size
+
+    def observe_function(self, name, latency):
+        with self.lock:
+            self.function_latency.setdefault(name, Histogram()).observe(latency)
+
+    def count_retry(self, service):
+        with self.lock:
+            self.retries[service] = self.retries.get(service, 0) + 1
+
+    def prometheus(self, job):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def histogram(metric, help_text, label_names, histograms):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for label_values, hist in sorted(histograms.items()):
+                if not isinstance(label_values, tuple):
+                    label_values = (label_values,)
+                labels = ",".join([f'job="{job}"'] + [f'{k}="{v}"' for k, v in zip(label_names, label_values)])
+                for bound, count in zip(BUCKETS, hist.buckets):
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{metric}_sum{{{labels}}} {hist.sum:.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {hist.count}")
+
+        def counter(metric, help_text, label_names, values):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for label_values, value in sorted(values.items()):
+                if not isinstance(label_values, tuple):
+                    label_values = (label_values,)
+                labels = ",".join([f'job="{job}"'] + [f'{k}="{v}"' for k, v in zip(label_names, label_values)])
+                lines.append(f"{metric}{{{labels}}} {value}")
+
+        with self.lock:
+            histogram("apra_upstream_request_duration_seconds", "Upstream HTTP request latency.",
+                      ("service", "method"), self.request_latency)
+            histogram("apra_function_duration_seconds", "Latency of instrumented enrichment functions.",
+                      ("function",), self.function_latency)
+            counter("apra_upstream_responses_total", "Upstream HTTP responses by status code.",
+                    ("service", "status"), self.status_codes)
+            counter("apra_upstream_retries_total", "Upstream requests retried.",
+                    ("service",), self.retries)
+            counter("apra_upstream_bytes_total", "Bytes sent to and received from upstream services.",
+                    ("service", "direction"), self.bytes)
+            lines.append("# HELP apra_run_last_completed_timestamp_seconds When the run finished.")
+            lines.append("# TYPE apra_run_last_completed_timestamp_seconds gauge")
+            lines.append(f'apra_run_last_completed_timestamp_seconds{{job="{job}"}} {time.time():.0f}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self, job, extra=None):
+        """Return the run as a JSON-serializable dict."""
+        with self.lock:
+            services = {}
+            for (service, method), hist in self.request_latency.items():
+                services.setdefault(service, {"requests": {}})["requests"][method] = hist.summary()
+            for (service, status), count in self.status_codes.items():
+                services.setdefault(service, {}).setdefault("status_codes", {})[status] = count
+            for service, count in self.retries.items():
+                services.setdefault(service, {})["retries"] = count
+            for (service, direction), count in self.bytes.items():
+                services.setdefault(service, {})[f"bytes_{direction}"] = count
+            return {
+                "job": job,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "duration_seconds": round(time.time() - self.started, 3),
+                "services": services,
+                "functions": {name: hist.summary() for name, hist in self.function_latency.items()},
+                **(extra or {}),
+            }
+
+
+registry = Registry()
+
+
+def timed(name):
+    """Decorator recording the wrapped function's latency under `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                registry.observe_function(name, time.monotonic() - start)
+        return wrapper
+    return decorator
+
+
+def _write_atomic(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def write_reports(job, extra=None, directory=None):
+    """Write <job>.prom and a timestamped <job>-<time>.json summary; return their paths."""
+    directory = directory or METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    prom_path = os.path.join(directory, f"{job}.prom")
+    json_path = os.path.join(directory, f"{job}-{time.strftime('%Y%m%dT%H%M%S')}.json")
+    _write_atomic(prom_path, registry.prometheus(job))
+    _write_atomic(json_path, json.dumps(registry.summary(job, extra), indent=2) + "\n")
+    print(f"Metrics written to {prom_path} and {json_path}")
+    return prom_path, json_path
@@ -0,0 +1,254 @@
+"""Local SQLite mirror of the Airtable Vacants table.
+
+sync() only downloads the records modified since the previous sync (selected
+with Airtable's LAST_MODIFIED_TIME() in filterByFormula) and upserts them; a
+full sync, at least every MIRROR_FULL_SYNC_DAYS, re-reads the table and drops
+records deleted in Airtable. Each record's fields are kept as JSON next to
+indexed columns for the fields lookups use, and its parcel geometry is decoded
+once into the geometry table with its bounding box and representative point.
+
+The enrichment scripts read from the mirror with --mirror instead of paging
+through Airtable; the 2021 study app reads the SQLite file directly (see
+data_store.load_mirror).
+
+    python mirror.py [--full]
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+import threading
+
+from dotenv import load_dotenv
+
+from airtable_io import iter_records, table_url, auth_headers
+from geometry import decode_geometry, representative_point, bounds
+from property_key import property_key
+
+load_dotenv()
+
+MIRROR_PATH = os.getenv("AIRTABLE_MIRROR_PATH", ".cache/vacants.sqlite")
+# Incremental syncs start this many seconds before the previous one did, so
+# edits made while it ran (or under clock skew) are not missed
+MIRROR_SYNC_OVERLAP = int(os.getenv("MIRROR_SYNC_OVERLAP", "300"))
+MIRROR_FULL_SYNC_DAYS = float(os.getenv("MIRROR_FULL_SYNC_DAYS", "7"))
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS records ("
+    " id TEXT PRIMARY KEY, created_time TEXT, synced_at REAL NOT NULL, fields TEXT NOT NULL,"
+    " address TEXT, block TEXT, lot TEXT, property_key TEXT, lat REAL, lng REAL)",
+    "CREATE INDEX IF NOT EXISTS records_block_lot ON records (block, lot)",
+    "CREATE INDEX IF NOT EXISTS records_property_key ON records (property_key)",
+    "CREATE INDEX IF NOT EXISTS records_location ON records (lng, lat)",
+    "CREATE TABLE IF NOT EXISTS geometry ("
+    " id TEXT PRIMARY KEY REFERENCES records (id) ON DELETE CASCADE, type TEXT NOT NULL,"
+    " min_lng REAL, min_lat REAL, max_lng REAL, max_lat REAL, point_lng REAL, point_lat REAL,"
+    " geometry TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS geometry_bounds ON geometry (min_lng, max_lng, min_lat, max_lat)",
+    "CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT NOT NULL)",
+]
+
+
+def _field(name):
+    """SQL for one field of a record's JSON."""
+    return "json_extract(fields, '$.\"{}\"')".format(name.replace('"', '""').replace("'", "''"))
+
+
+def missing_clause(*fields):
+    """WHERE clause matching records where any of the fields is empty (like missing_formula)."""
+    return "(" + " OR ".join(f"{_field(field)} IS NULL" for field in fields) + ")"
+
+
+def stale_clause(field, days):
+    """WHERE clause matching records whose date field is empty or older than `days` (like stale_formula)."""
+    return f"({_field(field)} IS NULL OR {_field(field)} < date('now', '-{int(days)} days'))"
+
+
+def _iso(timestamp):
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def modified_since_formula(timestamp):
+    """Airtable formula matching records modified after a Unix timestamp."""
+    return f"IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{_iso(timestamp)}'))"
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def geometry_row(record_id, value):
+    """The geometry table row for a record's geojson field, or None if it has no usable geometry."""
+    try:
+        geometry = decode_geometry(value)
+    except (ValueError, TypeError, KeyError, IndexError):
+        return None
+    if not geometry or geometry.get("type") not in ("Point", "Polygon", "MultiPolygon"):
+        return None
+    box = bounds(geometry)
+    if box is None:
+        return None
+    point = representative_point(geometry) or (None, None)
+    return (record_id, geometry["type"]) + box + tuple(point) + (json.dumps(geometry),)
+
+
+class AirtableMirror:
+    """SQLite copy of an Airtable table, with a query API over it."""
+
+    def __init__(self, path=MIRROR_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def _state(self, name):
+        row = self.conn.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return float(row[0]) if row else None
+
+    def _upsert(self, records, now):
+        rows, geometries = [], []
+        for record in records:
+            fields = record.get("fields", {})
+            address, block, lot = fields.get("Address"), fields.get("Block"), fields.get("Lot")
+            rows.append((record["id"], record.get("createdTime"), now, json.dumps(fields),
+                         address, None if block is None else str(block), None if lot is None else str(lot),
+                         property_key(address, block, lot), _number(fields.get("lat")), _number(fields.get("lng"))))
+            geometry = geometry_row(record["id"], fields["geojson"]) if fields.get("geojson") else None
+            if geometry:
+                geometries.append(geometry)
+        ids = [(row[0],) for row in rows]
+        self.conn.executemany("DELETE FROM geometry WHERE id = ?", ids)
+        self.conn.executemany("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.executemany("INSERT INTO geometry VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", geometries)
+
+    def sync(self, url, headers, full=False):
+        """Bring the mirror up to date with the Airtable table at url; returns the records downloaded.
+
+        Incremental unless full=True, the mirror is empty or its last full sync
+        is older than MIRROR_FULL_SYNC_DAYS.
+        """
+        started = time.time()
+        with self.lock:
+            synced_at = self._state("synced_at")
+            full_synced_at = self._state("full_synced_at")
+        if full_synced_at is None or started - full_synced_at > MIRROR_FULL_SYNC_DAYS * 86400:
+            full = True
+        formula = None if full else modified_since_formula(synced_at - MIRROR_SYNC_OVERLAP)
+
+        count = 0
+        batch = []
+        for record in iter_records(url, headers, formula=formula):
+            batch.append(record)
+            if len(batch) >= 1000:
+                with self.lock:
+                    self._upsert(batch, started)
+                count += len(batch)
+                batch = []
+        with self.lock:
+            self._upsert(batch, started)
+            count += len(batch)
+            if full:
+                # Whatever this sync did not see was deleted in Airtable
+                deleted = self.conn.execute("DELETE FROM records WHERE synced_at < ?", (started,)).rowcount
+                if deleted:
+                    print(f"Removed {deleted} records deleted in Airtable from the mirror")
+            names = ["synced_at", "full_synced_at"] if full else ["synced_at"]
+            self.conn.executemany("INSERT OR REPLACE INTO state VALUES (?, ?)", [(name, str(started)) for name in names])
+            self.conn.commit()
+        print(f"Mirror sync ({'full' if full else 'incremental'}): {count} records downloaded "
+              f"in {time.time() - started:.1f}s, {len(self)} in the mirror")
+        return count
+
+    def _record(self, row, fields=None):
+        record_id, created_time, data = row
+        data = json.loads(data)
+        if fields is not None:
+            data = {field: value for field, value in data.items() if field in fields}
+        return {"id": record_id, "createdTime": created_time, "fields": data}
+
+    def records(self, fields=None, where=None, params=()):
+        """Records in Airtable's {id, createdTime, fields} shape, like iter_records.
+
+        fields limits the fields returned; where is an SQL condition on the
+        records table (see missing_clause and stale_clause).
+        """
+        query = "SELECT id, created_time, fields FROM records"
+        if where:
+            query += f" WHERE {where}"
+        with self.lock:
+            rows = self.conn.execute(query + " ORDER BY rowid", params).fetchall()
+        return [self._record(row, fields) for row in rows]
+
+    def get(self, record_id):
+        """One record, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, created_time, fields FROM records WHERE id = ?", (record_id,)
+            ).fetchone()
+        return self._record(row) if row else None
+
+    def find(self, address=None, block=None, lot=None):
+        """The records of one property, by its canonical key (see property_key.py)."""
+        key = property_key(address, block, lot)
+        if key is None:
+            return []
+        return self.records(where="property_key = ?", params=(key,))
+
+    def within(self, min_lng, min_lat, max_lng, max_lat):
+        """Records whose parcel overlaps the box, or whose lat/lng falls in it if they have no parcel."""
+        return self.records(
+            where="id IN (SELECT id FROM geometry WHERE min_lng <= ? AND max_lng >= ? AND min_lat <= ? AND max_lat >= ?)"
+                  " OR (id NOT IN (SELECT id FROM geometry) AND lng BETWEEN ? AND ? AND lat BETWEEN ? AND ?)",
+            params=(max_lng, min_lng, max_lat, min_lat, min_lng, max_lng, min_lat, max_lat),
+        )
+
+    def geometry(self, record_id):
+        """The decoded GeoJSON geometry of a record's parcel, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT geometry FROM geometry WHERE id = ?", (record_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def synced_records(url, headers, fields=None, where=None, path=MIRROR_PATH):
+    """Sync the mirror at path with the table at url, then return its records (see AirtableMirror.records)."""
+    mirror = AirtableMirror(path)
+    mirror.sync(url, headers)
+    records = mirror.records(fields=fields, where=where)
+    mirror.close()
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync the local mirror of the Vacants table")
+    parser.add_argument("--full", action="store_true", help="re-read the whole table")
+    parser.add_argument("--path", default=MIRROR_PATH)
+    args = parser.parse_args(argv)
+
+    url = table_url(os.getenv("AIRTABLE_BASE_ID"), "Vacants")
+    mirror = AirtableMirror(args.path)
+    mirror.sync(url, auth_headers(os.getenv("AIRTABLE_API_KEY")), full=args.full)
+    mirror.close()
+
+
+if __name__ == "__main__":
+    main()
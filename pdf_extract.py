@@ -0,0 +1,142 @@
+"""Read the tables out of the city's list PDFs, replacing the manual tabula step.
+
+Each page's table is extracted in its own worker process, and the rows are
+normalized with the file's SOURCES entry from ingest.py, so a PDF release gives
+the same table as a CSV made from it. ingest.py picks the PDFs up by itself;
+this script extracts a new release directly, or compares the extraction with the
+tabula CSVs that were made by hand for the December 2024 lists.
+
+    python pdf_extract.py [--output data/2024-12/lists.csv] "data/2024-12/VACANT LOT LIST.pdf" ...
+    python pdf_extract.py --check [PDF ...]
+"""
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pdfplumber
+
+import ingest
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 4)))
+
+# Columns compared by --check; file and row differ between a PDF and its CSV by design
+CHECK_COLUMNS = [column for column in ingest.COLUMNS if column not in ("file", "row")]
+
+# Cells read as missing, like pandas does when reading the spreadsheet and CSV lists
+NA_VALUES = {"", "#N/A", "N/A", "n/a", "NA", "NULL", "null", "NaN", "nan", "None"}
+
+
+def page_count(path):
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_page(path, number):
+    """The rows of every table on one page (0-based), as lists of cell strings."""
+    with pdfplumber.open(path) as pdf:
+        tables = pdf.pages[number].extract_tables()
+    return [[cell or "" for cell in row] for table in tables for row in table]
+
+
+def read_table(path, workers=PDF_WORKERS):
+    """The PDF's table as a DataFrame of strings, headed by its first row.
+
+    The header row repeated at the top of later pages and empty rows are dropped,
+    and cells in NA_VALUES become None.
+    """
+    pages = page_count(path)
+    if workers > 1 and pages > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, pages)) as pool:
+            rows_by_page = list(pool.map(extract_page, [path] * pages, range(pages)))
+    else:
+        rows_by_page = [extract_page(path, number) for number in range(pages)]
+
+    rows = [row for page in rows_by_page for row in page if any(cell.strip() for cell in row)]
+    if not rows:
+        raise ValueError(f"{path}: no table found")
+    header = rows[0]
+    width = len(header)
+    body = [row for row in rows[1:] if row != header]
+    ragged = [row for row in body if len(row) != width]
+    if ragged:
+        raise ValueError(f"{path}: {len(ragged)} rows without {width} columns, first {ragged[0]}")
+    body = [[None if cell.strip() in NA_VALUES else cell for cell in row] for row in body]
+    return pd.DataFrame(body, columns=header, dtype=object)
+
+
+def _source(path):
+    # SOURCES patterns are relative to the data directory, which holds a directory per release
+    source = ingest.source_for(path, os.path.dirname(os.path.dirname(os.path.abspath(path))))
+    if source is None:
+        raise ValueError(f"{path}: no SOURCES entry in ingest.py covers this file")
+    return source
+
+
+def extract(path, workers=PDF_WORKERS):
+    """Extract a list PDF into the normalized table (ingest.COLUMNS)."""
+    return ingest.normalize(read_table(path, workers), path, _source(path))
+
+
+def golden_path(path):
+    """The hand-made tabula CSV for a PDF, or None."""
+    directory, name = os.path.split(path)
+    csv = os.path.join(directory, f"tabula-{os.path.splitext(name)[0]}.csv")
+    return csv if os.path.exists(csv) else None
+
+
+def _comparable(table):
+    return table[CHECK_COLUMNS].astype(str).sort_values(CHECK_COLUMNS, ignore_index=True)
+
+
+def check(path, workers=PDF_WORKERS):
+    """Compare the extraction of path with its tabula CSV; returns the number of differing rows."""
+    csv = golden_path(path)
+    if csv is None:
+        print(f"{path}: no tabula CSV to check against")
+        return 0
+    extracted = _comparable(extract(path, workers))
+    expected = _comparable(ingest.parse_file(csv, _source(csv)))
+    merged = extracted.merge(expected, how="outer", indicator=True)
+    differing = merged[merged["_merge"] != "both"]
+    if differing.empty:
+        print(f"{path}: {len(extracted)} rows, same as {os.path.basename(csv)}")
+    else:
+        which = differing["_merge"].map({"left_only": "pdf", "right_only": "csv"})
+        print(f"{path}: {len(differing)} rows differ from {os.path.basename(csv)}")
+        print(differing[CHECK_COLUMNS].assign(only_in=which).to_string(index=False))
+    return len(differing)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract the city's vacant building/lot list PDFs")
+    parser.add_argument("pdfs", nargs="*",
+                        help="PDF files (default: every list PDF under the data directory)")
+    parser.add_argument("--output", help="where to write the table (.csv or .parquet)")
+    parser.add_argument("--check", action="store_true",
+                        help="compare each PDF's extraction with the tabula CSV next to it")
+    parser.add_argument("--workers", type=int, default=PDF_WORKERS)
+    args = parser.parse_args(argv)
+
+    pdfs = args.pdfs or [path for path, _ in ingest.list_files() if path.endswith(".pdf")]
+    if not pdfs:
+        print("No PDF lists found")
+        return 1
+    if args.check:
+        differing = sum(check(path, args.workers) for path in sorted(pdfs))
+        return 1 if differing else 0
+
+    table = pd.concat([extract(path, args.workers) for path in pdfs], ignore_index=True)
+    print(table.groupby(["date", "type"]).size().to_string())
+    if args.output:
+        if args.output.endswith(".parquet"):
+            table.to_parquet(args.output, index=False)
+        else:
+            table.to_csv(args.output, index=False)
+        print(f"Wrote {len(table)} rows to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,359 @@
+"""Single-scan enrichment pipeline for the Vacants table.
+
+Streams records from Airtable once and passes each one through the enrichment
+stages (parcel GeoJSON, geocode, tax scrape). Every stage has its own worker
+pool, so while one record waits on the tax site the next is already being
+geocoded. The updates from all stages are merged into one write per record,
+which is skipped when they match the record's current values, and records of
+the same property (by canonical key) share one lookup per stage.
+
+    python pipeline.py [--stages parcel,geocode,tax] [--incremental] [--resume] [--mirror]
+"""
+import os
+import abc
+import time
+import datetime
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from dotenv import load_dotenv
+
+import upstream
+import metrics
+import get_geo
+import get_taxes
+from airtable_io import (AirtableWriteBuffer, report_failures, missing_formula, stale_formula,
+                         any_formula, iter_records, table_url, auth_headers, changed_fields)
+from run_journal import RunJournal, FreshnessLog
+from property_key import property_key
+from mirror import synced_records
+
+load_dotenv()
+
+AIRTABLE_URL = table_url(os.getenv("AIRTABLE_BASE_ID"), "Vacants")
+HEADERS = auth_headers(os.getenv("AIRTABLE_API_KEY"))
+
+# Upper bound on records between the Airtable scan and the write buffer
+MAX_IN_FLIGHT = int(os.getenv("PIPELINE_MAX_IN_FLIGHT", "200"))
+
+
+class Stage(abc.ABC):
+    """One enrichment step.
+
+    Subclasses set `name`, the Airtable `fields` they read, how many `workers`
+    run them, and implement needs(), run() and formula().
+    """
+    name = None
+    fields = []
+    workers = 4
+    # Whether once() keeps each property's result for the rest of the run. Stages
+    # whose lookups LookupCache already keeps drop it when no record is waiting
+    # on it any more, so memory follows the records in flight, not the table
+    keep_results = False
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}  # property key -> Future of its lookup
+        self.waiting = {}  # property key -> records in once() for it
+
+    def once(self, key, func):
+        """Return func() for the first record of a property (by canonical key); the
+        property's other records, including concurrent ones, share that result."""
+        if key is None:
+            return func()
+        with self.lock:
+            future = self.results.get(key)
+            owner = future is None
+            if owner:
+                future = self.results[key] = Future()
+            self.waiting[key] = self.waiting.get(key, 0) + 1
+        try:
+            if owner:
+                try:
+                    future.set_result(func())
+                except Exception as e:
+                    future.set_exception(e)
+            return future.result()
+        finally:
+            with self.lock:
+                self.waiting[key] -= 1
+                if not self.waiting[key]:
+                    del self.waiting[key]
+                    if not self.keep_results:
+                        del self.results[key]
+
+    @abc.abstractmethod
+    def needs(self, fields):
+        """Return True if the record is missing this stage's output."""
+
+    @abc.abstractmethod
+    def run(self, fields):
+        """Return the Airtable field updates for one record."""
+
+    @abc.abstractmethod
+    def formula(self, args):
+        """Airtable formula selecting records this stage needs in incremental mode."""
+
+
+class ParcelStage(Stage):
+    name = "parcel"
+    fields = ["Block", "Lot", "geojson"]
+    workers = int(os.getenv("PARCEL_WORKERS", "4"))
+
+    def needs(self, fields):
+        return "geojson" not in fields and bool(fields.get("Block")) and bool(fields.get("Lot"))
+
+    def run(self, fields):
+        geojson_data = self.once(property_key(block=fields["Block"], lot=fields["Lot"]),
+                                 lambda: get_geo.get_geojson(fields["Block"], fields["Lot"]))
+        geojson = get_geo.geojson_field(geojson_data) if geojson_data else None
+        return {"geojson": geojson} if geojson else {}
+
+    def formula(self, args):
+        return missing_formula("geojson")
+
+
+class GeocodeStage(Stage):
+    """Fill lat/lng from the parcel geometry (set by ParcelStage when it ran first),
+    falling back to Google for records without one."""
+    name = "geocode"
+    fields = ["Address", "Block", "Lot", "lat", "lng", "geojson"]
+    workers = int(os.getenv("GEOCODE_WORKERS", "10"))
+
+    def needs(self, fields):
+        return ("lat" not in fields or "lng" not in fields) and bool(fields.get("Address") or fields.get("geojson"))
+
+    def run(self, fields):
+        key = property_key(fields.get("Address"), fields.get("Block"), fields.get("Lot"))
+        geocode_data = self.once(key, lambda: get_geo.locate(fields.get("Address"), fields.get("geojson")))
+        if geocode_data:
+            return {"lat": geocode_data["lat"], "lng": geocode_data["lng"]}
+        return {}
+
+    def formula(self, args):
+        return missing_formula("lat", "lng")
+
+
+class TaxStage(Stage):
+    name = "tax"
+    fields = ["Block", "Lot", "tax_updated"] + get_taxes.TAX_VALUE_FIELDS
+    # Enough workers for the tax site's adaptive limit to grow into
+    workers = upstream.SERVICES["taxsite"]["concurrency"]
+    # Tax results are small and not cached locally, so each property is only
+    # scraped once per run
+    keep_results = True
+    # Records checked within this many days are skipped; main() sets it from
+    # --stale-days in incremental mode
+    stale_days = 0
+
+    def needs(self, fields):
+        block_id, lot_id = get_taxes.find_block_lot(fields)
+        if not (block_id and lot_id):
+            return False
+        cutoff = datetime.date.today() - datetime.timedelta(days=self.stale_days)
+        # Strictly before the cutoff, like stale_formula and stale_clause
+        return not fields.get("tax_updated") or fields["tax_updated"] < cutoff.isoformat()
+
+    def run(self, fields):
+        block_id, lot_id = get_taxes.find_block_lot(fields)
+        tax_info = self.once(property_key(block=block_id, lot=lot_id),
+                             lambda: get_taxes.get_tax_account_info(block_id, lot_id))
+        return get_taxes.tax_update_fields(tax_info)
+
+    def formula(self, args):
+        return stale_formula("tax_updated", args.stale_days)
+
+
+# Stages in the order a record passes through them
+STAGES = {stage.name: stage for stage in (ParcelStage(), GeocodeStage(), TaxStage())}
+
+
+class Pipeline:
+    """Run records through a chain of stages, each on its own thread pool, and write once per record."""
+
+    def __init__(self, stages, writer, journal=None, done=None, max_in_flight=MAX_IN_FLIGHT, freshness=None):
+        self.stages = stages
+        self.writer = writer
+        self.journal = journal
+        self.freshness = freshness
+        self.done = done or {}
+        self.pools = {stage.name: ThreadPoolExecutor(max_workers=stage.workers,
+                                                     thread_name_prefix=stage.name)
+                      for stage in stages}
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.in_flight = 0
+        self.completed = 0
+        self.stage_counts = {stage.name: 0 for stage in stages}
+        self.unchanged = 0
+        self.pending_stages = {}
+
+    def submit(self, record):
+        """Feed one record into the first stage; blocks while MAX_IN_FLIGHT records are queued."""
+        self.slots.acquire()
+        with self.lock:
+            self.in_flight += 1
+        self._advance(record, 0, {}, [])
+
+    def _advance(self, record, index, updates, ran):
+        """Hand the record to the next stage it needs, or finish it.
+
+        A stage whose needs() raises, or whose pool refuses the record, is
+        skipped like one whose run() fails.
+        """
+        fields = dict(record["fields"], **updates)
+        skip = self.done.get(record["id"], ())
+        for i in range(index, len(self.stages)):
+            stage = self.stages[i]
+            try:
+                if stage.name not in skip and stage.needs(fields):
+                    self.pools[stage.name].submit(self._run_stage, record, i, updates, ran)
+                    return
+            except Exception as e:
+                print(f"Error in {stage.name} stage for record {record['id']}: {str(e)}")
+        self._finish(record, updates, ran)
+
+    def _run_stage(self, record, index, updates, ran):
+        stage = self.stages[index]
+        try:
+            stage_updates = stage.run(dict(record["fields"], **updates))
+            updates = dict(updates, **stage_updates)
+            ran = ran + [stage.name]
+            with self.lock:
+                self.stage_counts[stage.name] += 1
+        except Exception as e:
+            print(f"Error in {stage.name} stage for record {record['id']}: {str(e)}")
+        self._advance(record, index + 1, updates, ran)
+
+    def _finish(self, record, updates, ran):
+        """Queue the record's write, or journal it if nothing changed, then free its slot.
+
+        The slot is freed even if that fails, so join() never waits on a lost record.
+        """
+        try:
+            changes = changed_fields(record["fields"], updates)
+            if changes:
+                with self.lock:
+                    self.pending_stages[record["id"]] = ran
+                self.writer.add(record["id"], changes)
+            elif ran:
+                if updates:
+                    with self.lock:
+                        self.unchanged += 1
+                self._done(record["id"], ran)
+        except Exception as e:
+            print(f"Error finishing record {record['id']}: {str(e)}")
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.idle.notify_all()
+            self.slots.release()
+
+    def _done(self, record_id, ran):
+        for stage_name in ran:
+            if self.journal:
+                self.journal.mark_done(record_id, stage_name)
+            if self.freshness:
+                self.freshness.mark_checked(record_id, stage_name)
+
+    def written(self, record_ids):
+        """Write buffer callback: journal every stage that contributed to the written records."""
+        for record_id in record_ids:
+            with self.lock:
+                ran = self.pending_stages.pop(record_id, [])
+            self._done(record_id, ran)
+
+    def join(self):
+        """Wait for every submitted record to leave the last stage, then stop the pools."""
+        with self.lock:
+            while self.in_flight:
+                self.idle.wait()
+        for pool in self.pools.values():
+            pool.shutdown()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Enrich Vacants records in a single pass over the table")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"comma-separated stages to run, in order (default: {','.join(STAGES)})")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only fetch records that at least one stage needs")
+    parser.add_argument("--stale-days", type=int, default=30,
+                        help="age in days after which tax_updated counts as stale (default: 30)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip stages the previous, interrupted run finished")
+    parser.add_argument("--mirror", action="store_true",
+                        help="read records from the local mirror (synced first) instead of scanning Airtable")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.stages.split(",") if name not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage {', '.join(unknown)} (choose from {', '.join(STAGES)})")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stages = [STAGES[name] for name in args.stages.split(",")]
+    if args.incremental:
+        STAGES["tax"].stale_days = args.stale_days
+
+    fields = sorted({field for stage in stages for field in stage.fields})
+    formula = any_formula(*[stage.formula(args) for stage in stages]) if args.incremental else None
+
+    journal = RunJournal("pipeline", resume=args.resume)
+    done = {}
+    if args.resume:
+        for stage in stages:
+            for record_id in journal.completed(stage.name):
+                done.setdefault(record_id, set()).add(stage.name)
+        print(f"Resuming: {len(done)} records have finished stages")
+
+    # tax_updated is only written with a change, so when records were last
+    # checked is also kept locally
+    freshness = FreshnessLog()
+    if args.incremental and "tax" in args.stages:
+        recent = freshness.checked_since("tax", args.stale_days)
+        for record_id in recent:
+            done.setdefault(record_id, set()).add("tax")
+
+    pipeline = None
+    writer = AirtableWriteBuffer(AIRTABLE_URL, HEADERS, on_written=lambda ids: pipeline.written(ids))
+    pipeline = Pipeline(stages, writer, journal=journal, done=done, freshness=freshness)
+
+    reporter = upstream.start_status_reporter(["taxsite"]) if "tax" in args.stages else None
+    start = time.monotonic()
+    scanned = 0
+    # The mirror is filtered by each stage's needs() rather than a formula
+    if args.mirror:
+        records = synced_records(AIRTABLE_URL, HEADERS, fields=fields)
+    else:
+        records = iter_records(AIRTABLE_URL, HEADERS, formula=formula, fields=fields)
+    # Whatever stops the scan, the records already queued are still written
+    try:
+        for record in records:
+            pipeline.submit(record)
+            scanned += 1
+    finally:
+        pipeline.join()
+        if reporter:
+            reporter.set()
+        failed = writer.close()
+        journal.close()
+        freshness.close()
+    elapsed = time.monotonic() - start
+
+    rate = scanned / elapsed if elapsed else 0.0
+    print(f"Processed {scanned} records in {elapsed:.1f}s ({rate:.2f} records/sec)")
+    print("Stage runs: " + ", ".join(f"{name} {count}" for name, count in pipeline.stage_counts.items()))
+    print(f"Airtable writes: {writer.summary()}, {pipeline.unchanged} unchanged records not written")
+    report_failures(failed)
+    metrics.write_reports("pipeline", {"records": scanned, "records_per_second": round(rate, 3),
+                                       "stage_runs": pipeline.stage_counts, "unchanged": pipeline.unchanged,
+                                       "failed_writes": len(failed)})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Canonical keys for properties, so the differently written records of one building match.
+
+Block/lot identifies a parcel; when a record has none, its canonicalized
+street address is used ("ACADEMY STREET" and "Academy St." give the same
+key). PropertyIndex maps each key to every observation of the property and
+remembers which block/lot an address was seen with, so address-only
+observations join the parcel's history.
+"""
+import re
+
+STREET_TYPES = {
+    "AVENUE": "AVE", "AV": "AVE", "STREET": "ST", "STR": "ST", "BOULEVARD": "BLVD", "DRIVE": "DR",
+    "PLACE": "PL", "ROAD": "RD", "TERRACE": "TER", "TERR": "TER", "COURT": "CT", "LANE": "LN",
+    "PARKWAY": "PKWY", "HIGHWAY": "HWY", "SQUARE": "SQ", "PLAZA": "PLZ", "CIRCLE": "CIR",
+}
+DIRECTIONS = {"NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W"}
+# Street names written several ways in the city's lists, after abbreviation
+STREET_ALIASES = {
+    "MLK DR": "MARTIN LUTHER KING DR",
+    "M L KING DR": "MARTIN LUTHER KING DR",
+    "JFK BLVD": "KENNEDY BLVD",
+    "JOHN F KENNEDY BLVD": "KENNEDY BLVD",
+}
+
+# Everything from the city name on ("..., Jersey City, NJ 07304")
+CITY_SUFFIX = re.compile(r"\b(JERSEY CITY|JCNJ|JC NJ)\b.*$")
+
+
+def canonical_address(address):
+    """Return the canonical form of a street address (e.g. "163 CLERK ST"), or None."""
+    if _missing(address):
+        return None
+    # Dots and hyphens survive only inside house numbers ("99.5", "10-12")
+    text = re.sub(r"[^\w\s.-]", " ", str(address).upper())
+    text = CITY_SUFFIX.sub("", re.sub(r"(?<!\d)[.-]|[.-](?!\d)", " ", text))
+    words = text.split()
+    if not words:
+        return None
+    number = words[0] if words[0][0].isdigit() else None
+    street = " ".join(STREET_TYPES.get(word, DIRECTIONS.get(word, word)) for word in (words[1:] if number else words))
+    street = STREET_ALIASES.get(street, street)
+    return f"{number} {street}" if number else street or None
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and value != value) or not str(value).strip()
+
+
+def _canonical_part(value):
+    text = str(value).strip().upper()
+    if re.fullmatch(r"\d+(\.\d+)?", text):
+        text = text.rstrip("0").rstrip(".") if "." in text else text
+        text = text.lstrip("0") or "0"
+    return text
+
+
+def canonical_block_lot(block, lot):
+    """Return "<block>-<lot>" with formatting differences (12.00, 012) removed, or None."""
+    if _missing(block) or _missing(lot):
+        return None
+    return f"{_canonical_part(block)}-{_canonical_part(lot)}"
+
+
+def property_key(address=None, block=None, lot=None):
+    """The canonical key of a property: its block/lot if known, its address otherwise."""
+    block_lot = canonical_block_lot(block, lot)
+    if block_lot:
+        return f"BL {block_lot}"
+    street = canonical_address(address)
+    return f"AD {street}" if street else None
+
+
+class PropertyIndex:
+    """Hash index from canonical property key to every observation of the property."""
+
+    def __init__(self):
+        self.observations = {}  # key -> [observation, ...]
+        self.aliases = {}  # address key -> block/lot key it was seen with
+
+    def key(self, address=None, block=None, lot=None):
+        """Return the key the property is indexed under (None if it has no address or block/lot)."""
+        key = property_key(address, block, lot)
+        return self.aliases.get(key, key)
+
+    def add(self, observation, address=None, block=None, lot=None):
+        """Index an observation and return its key (None if it has no address or block/lot)."""
+        key = property_key(address, block, lot)
+        if key is None:
+            return None
+        address_key = property_key(address)
+        if key.startswith("BL ") and address_key and address_key not in self.aliases:
+            self.aliases[address_key] = key
+            # Earlier address-only observations of this building join the parcel
+            self.observations.setdefault(key, []).extend(self.observations.pop(address_key, []))
+        key = self.aliases.get(key, key)
+        self.observations.setdefault(key, []).append(observation)
+        return key
+
+    def history(self, address=None, block=None, lot=None):
+        """Every observation of the property, in the order they were added."""
+        return list(self.observations.get(self.key(address, block, lot), []))
+
+    def __len__(self):
+        return len(self.observations)
+
+    def __iter__(self):
+        return iter(self.observations.items())
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Journals live next to the lookup cache, one SQLite file per script
+RUN_JOURNAL_DIR = os.getenv("RUN_JOURNAL_DIR", ".cache")
+
+
+class RunJournal:
+    """Record which (record, stage) pairs a run has finished, so a killed run can resume.
+
+    Safe to use from many threads at once (one connection behind a lock) and from
+    several processes (SQLite WAL mode with a busy timeout).
+    Starting without resume clears the previous run's entries.
+    """
+
+    def __init__(self, name, resume=False, path=None):
+        self.path = path or os.path.join(RUN_JOURNAL_DIR, f"journal-{name}.sqlite")
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completed ("
+            " record_id TEXT NOT NULL, stage TEXT NOT NULL, completed_at REAL NOT NULL,"
+            " PRIMARY KEY (record_id, stage))"
+        )
+        if not resume:
+            self.conn.execute("DELETE FROM completed")
+        self.conn.commit()
+
+    def completed(self, stage):
+        """Return the set of record ids that finished the stage."""
+        with self.lock:
+            rows = self.conn.execute("SELECT record_id FROM completed WHERE stage = ?", (stage,))
+            return {row[0] for row in rows}
+
+    def mark_done(self, record_ids, stage):
+        """Record that the stage finished for one record id or a list of them."""
+        if isinstance(record_ids, str):
+            record_ids = [record_ids]
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO completed (record_id, stage, completed_at) VALUES (?, ?, ?)",
+                [(record_id, stage, now) for record_id in record_ids],
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class FreshnessLog:
+    """Remember when each record was last checked by a stage, across runs.
+
+    Unlike RunJournal it is never cleared. It stands in for freshness fields
+    such as tax_updated, which are no longer written when nothing changed, so
+    incremental runs can still skip records checked recently.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(RUN_JOURNAL_DIR, "freshness.sqlite")
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checked ("
+            " record_id TEXT NOT NULL, stage TEXT NOT NULL, checked_at REAL NOT NULL,"
+            " PRIMARY KEY (record_id, stage))"
+        )
+        self.conn.commit()
+
+    def checked_since(self, stage, days):
+        """Return the set of record ids the stage checked within the last `days` days."""
+        cutoff = time.time() - days * 24 * 60 * 60
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT record_id FROM checked WHERE stage = ? AND checked_at > ?", (stage, cutoff)
+            )
+            return {row[0] for row in rows}
+
+    def mark_checked(self, record_ids, stage):
+        """Record that the stage checked one record id or a list of them just now."""
+        if isinstance(record_ids, str):
+            record_ids = [record_ids]
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO checked (record_id, stage, checked_at) VALUES (?, ?, ?)",
+                [(record_id, stage, now) for record_id in record_ids],
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,243 @@
+"""Which properties entered, left or stayed on each list between releases.
+
+Every list (type) is a series of snapshots, one per release that has it. A
+snapshot is the set of its properties' canonical keys (block/lot, or the address
+when there is none; see property_key.py), and consecutive snapshots of a list are
+compared with set operations:
+
+    entered    on this snapshot, not on the previous one (or the list's first snapshot)
+    persisted  on both; `since` is the snapshot its current spell on the list began
+    exited     on the previous snapshot, not on this one
+
+Each event carries how long the property has been on the list: `snapshots` in
+the spell and `tenure_days` (from `since` to this snapshot, or to the last one it
+was on for exits). Results are kept in SQLite and updated incrementally: only
+snapshots that are new or changed are compared with their predecessor, and the
+ones after them. A release that gives the block/lot of addresses listed earlier
+re-keys those addresses, so their history is recomputed from their first snapshot.
+
+    python snapshots.py [--lists data/lists.csv]   # update from an ingest.py table
+    python snapshots.py --events 2018-07-01        # print one release's changes
+"""
+import os
+import hashlib
+import sqlite3
+import argparse
+import datetime
+
+import pandas as pd
+
+from property_key import PropertyIndex, property_key
+
+SNAPSHOT_DB_PATH = os.getenv("SNAPSHOT_DB_PATH", "data/snapshots.sqlite")
+
+EVENTS = ("entered", "persisted", "exited")
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS snapshots ("
+    " type TEXT NOT NULL, date TEXT NOT NULL, fingerprint TEXT NOT NULL, size INTEGER NOT NULL,"
+    " PRIMARY KEY (type, date))",
+    "CREATE TABLE IF NOT EXISTS members ("
+    " type TEXT NOT NULL, date TEXT NOT NULL, key TEXT NOT NULL, address TEXT,"
+    " PRIMARY KEY (type, date, key))",
+    "CREATE INDEX IF NOT EXISTS members_key ON members (key)",
+    "CREATE TABLE IF NOT EXISTS events ("
+    " type TEXT NOT NULL, date TEXT NOT NULL, key TEXT NOT NULL, event TEXT NOT NULL,"
+    " previous TEXT, since TEXT NOT NULL, snapshots INTEGER NOT NULL, tenure_days INTEGER NOT NULL,"
+    " PRIMARY KEY (type, date, key))",
+    "CREATE INDEX IF NOT EXISTS events_key ON events (key)",
+    # address key -> the block/lot key it was seen with
+    "CREATE TABLE IF NOT EXISTS aliases (address_key TEXT PRIMARY KEY, key TEXT NOT NULL)",
+]
+
+
+def _days(start, end):
+    return (datetime.date.fromisoformat(end) - datetime.date.fromisoformat(start)).days
+
+
+def fingerprint(rows):
+    """Hash of a snapshot's (address, block, lot) rows, independent of their order."""
+    lines = sorted("|".join("" if pd.isna(value) else str(value) for value in row) for row in rows)
+    return hashlib.sha1("\n".join(lines).encode()).hexdigest()
+
+
+def diff(previous, current, date, previous_date=None):
+    """Compare two snapshots.
+
+    previous maps each key on the previous snapshot to its (since, snapshots);
+    current is the set of keys on this one. Returns (events, state): the event
+    rows for this snapshot and the same mapping for it.
+    """
+    events = []
+    state = {}
+    for key in current - previous.keys():
+        state[key] = (date, 1)
+        events.append((key, "entered", previous_date, date, 1, 0))
+    for key in current & previous.keys():
+        since, snapshots = previous[key]
+        state[key] = (since, snapshots + 1)
+        events.append((key, "persisted", previous_date, since, snapshots + 1, _days(since, date)))
+    for key in previous.keys() - current:
+        since, snapshots = previous[key]
+        events.append((key, "exited", previous_date, since, snapshots, _days(since, previous_date)))
+    return events, state
+
+
+class SnapshotStore:
+    """SQLite store of list snapshots and the events between them."""
+
+    def __init__(self, path=SNAPSHOT_DB_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def _index(self):
+        index = PropertyIndex()
+        index.aliases = dict(self.conn.execute("SELECT address_key, key FROM aliases"))
+        return index
+
+    def _rekey(self, aliases):
+        """Move members listed under an address to its block/lot key; returns {type: first date affected}."""
+        dirty = {}
+        for address_key, key in aliases.items():
+            rows = self.conn.execute(
+                "SELECT type, MIN(date) FROM members WHERE key = ? GROUP BY type", (address_key,)
+            )
+            for list_type, date in rows:
+                dirty[list_type] = min(date, dirty.get(list_type, date))
+            self.conn.execute("UPDATE OR IGNORE members SET key = ? WHERE key = ?", (key, address_key))
+            self.conn.execute("DELETE FROM members WHERE key = ?", (address_key,))
+        self.conn.executemany("INSERT OR REPLACE INTO aliases VALUES (?, ?)", aliases.items())
+        return dirty
+
+    def _state(self, list_type, date):
+        rows = self.conn.execute(
+            "SELECT key, since, snapshots FROM events WHERE type = ? AND date = ? AND event != 'exited'",
+            (list_type, date),
+        )
+        return {key: (since, snapshots) for key, since, snapshots in rows}
+
+    def _replay(self, list_type, start):
+        """Recompute the list's events from snapshot `start` on; returns how many snapshots were compared."""
+        dates = [row[0] for row in self.conn.execute(
+            "SELECT date FROM snapshots WHERE type = ? ORDER BY date", (list_type,)
+        )]
+        position = dates.index(start)
+        previous_date = dates[position - 1] if position else None
+        previous = self._state(list_type, previous_date) if previous_date else {}
+        self.conn.execute("DELETE FROM events WHERE type = ? AND date >= ?", (list_type, start))
+        for date in dates[position:]:
+            current = {row[0] for row in self.conn.execute(
+                "SELECT key FROM members WHERE type = ? AND date = ?", (list_type, date)
+            )}
+            events, previous = diff(previous, current, date, previous_date)
+            self.conn.executemany(
+                "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(list_type, date) + event for event in events],
+            )
+            previous_date = date
+        return len(dates) - position
+
+    def update(self, table):
+        """Add or replace the snapshots in an ingest.py table (any subset of releases).
+
+        Snapshots not in the table are kept. Returns {type: snapshots compared}.
+        """
+        table = table[table["street_address"].notna() | table["block"].notna()]
+        index = self._index()
+        known = dict(index.aliases)
+        for row in table.itertuples(index=False):
+            index.add((row.type, row.date), row.street_address, row.block, row.lot)
+        dirty = self._rekey({k: v for k, v in index.aliases.items() if known.get(k) != v})
+
+        stored = {(t, d): f for t, d, f in self.conn.execute("SELECT type, date, fingerprint FROM snapshots")}
+        for (list_type, date), rows in table.groupby(["type", "date"], sort=True):
+            identity = rows[["street_address", "block", "lot"]].itertuples(index=False)
+            digest = fingerprint(identity)
+            if stored.get((list_type, date)) == digest:
+                continue
+            members = {}
+            for row in rows.itertuples(index=False):
+                key = index.key(row.street_address, row.block, row.lot)
+                members.setdefault(key, row.street_address)
+            self.conn.execute("DELETE FROM members WHERE type = ? AND date = ?", (list_type, date))
+            self.conn.executemany(
+                "INSERT INTO members VALUES (?, ?, ?, ?)",
+                [(list_type, date, key, address) for key, address in members.items()],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)", (list_type, date, digest, len(members))
+            )
+            dirty[list_type] = min(date, dirty.get(list_type, date))
+
+        compared = {list_type: self._replay(list_type, start) for list_type, start in sorted(dirty.items())}
+        self.conn.commit()
+        return compared
+
+    def events(self, date=None, list_type=None, event=None):
+        """Events as a DataFrame, optionally for one snapshot date, list and kind."""
+        query = ("SELECT e.type, e.date, e.key, COALESCE(m.address, p.address) AS address, e.event,"
+                 " e.previous, e.since, e.snapshots, e.tenure_days FROM events e"
+                 " LEFT JOIN members m ON m.type = e.type AND m.date = e.date AND m.key = e.key"
+                 " LEFT JOIN members p ON p.type = e.type AND p.date = e.previous AND p.key = e.key")
+        conditions, params = [], []
+        for column, value in (("e.date", date), ("e.type", list_type), ("e.event", event)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return pd.read_sql_query(query + " ORDER BY e.type, e.date, e.event, e.key", self.conn, params=params)
+
+    def history(self, address=None, block=None, lot=None):
+        """Every event of one property, oldest first."""
+        key = self._index().key(address, block, lot) or property_key(address, block, lot)
+        return pd.read_sql_query(
+            "SELECT type, date, event, since, snapshots, tenure_days FROM events WHERE key = ? ORDER BY date, type",
+            self.conn, params=(key,),
+        )
+
+    def summary(self):
+        """Count of each event per list and snapshot."""
+        counts = pd.read_sql_query(
+            "SELECT type, date, event, COUNT(*) AS properties FROM events GROUP BY type, date, event", self.conn
+        )
+        table = counts.pivot_table(index=["type", "date"], columns="event", values="properties", fill_value=0)
+        return table.reindex(columns=list(EVENTS), fill_value=0).astype(int)
+
+    def close(self):
+        self.conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Track properties entering and leaving the lists")
+    parser.add_argument("--lists", help="table written by ingest.py (default: run ingest.py now)")
+    parser.add_argument("--db", default=SNAPSHOT_DB_PATH)
+    parser.add_argument("--events", metavar="DATE", help="print the events of one snapshot instead")
+    args = parser.parse_args(argv)
+
+    store = SnapshotStore(args.db)
+    if args.events:
+        with pd.option_context("display.max_rows", None, "display.width", 200):
+            print(store.events(date=args.events))
+        return
+    if args.lists:
+        if args.lists.endswith(".parquet"):
+            table = pd.read_parquet(args.lists)
+        else:
+            table = pd.read_csv(args.lists, dtype=object)
+    else:
+        import ingest
+        table = ingest.ingest()
+    compared = store.update(table)
+    print(f"Compared {sum(compared.values())} snapshots ({', '.join(f'{t} {n}' for t, n in compared.items()) or 'none changed'})")
+    print(store.summary().to_string())
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+from dataclasses import dataclass, asdict
+from typing import Optional, Union
+
+import lxml.html
+
+# Row label -> (record field, where the value sits in that row)
+# "text" values are in the row's first col-md-2 div, "amount" values in its
+# first right-aligned col-md-1 div; both wrap the value in <span class="red">.
+LABELS = {
+    "Account#:": ("account_number", "text"),
+    "Location:": ("location", "text"),
+    "Address:": ("address", "text"),
+    "City/State:": ("city_state", "text"),
+    "Principal:": ("principal", "amount"),
+    "Total:": ("total", "amount"),
+}
+
+
+@dataclass
+class TaxAccountRecord:
+    """Fields scraped from a tax site ViewPay page."""
+    account_number: Optional[str] = None
+    location: Optional[str] = None
+    address: Optional[str] = None
+    city_state: Optional[str] = None
+    principal: Optional[str] = None
+    total: Optional[str] = None
+    tax_balance: Union[float, str, None] = None
+    errors: Optional[list] = None
+
+    def fields(self):
+        """Return the populated fields as a dict, without errors."""
+        return {k: v for k, v in asdict(self).items() if v is not None and k != "errors"}
+
+
+def _classes(element):
+    return element.get("class", "").split()
+
+
+def _red_text(element):
+    for span in element.iter("span"):
+        if "red" in _classes(span):
+            return span.text_content().strip()
+    return None
+
+
+def _parse_row(row, record):
+    """Read every label/value pair in a row with one walk over its divs."""
+    labels = []
+    text_div = None
+    amount_div = None
+    for div in row.iter("div"):
+        classes = _classes(div)
+        # Label divs hold only a single text node, e.g. <div>Location:</div>
+        if len(div) == 0 and div.text:
+            for label, target in LABELS.items():
+                if label in div.text:
+                    labels.append(target)
+        if text_div is None and "col-md-2" in classes:
+            text_div = div
+        if amount_div is None and "col-md-1" in classes and div.get("style") == "text-align:right":
+            amount_div = div
+
+    for field, kind in labels:
+        if field == "account_number" and record.account_number:
+            continue
+        source = text_div if kind == "text" else amount_div
+        value = _red_text(source) if source is not None else None
+        if value is not None:
+            setattr(record, field, value)
+
+
+def parse_balance(total):
+    """Convert a currency string like "$1,234.56" to a float, or return it unchanged."""
+    try:
+        return float(total.replace("$", "").replace(",", ""))
+    except ValueError:
+        return total
+
+
+def parse_tax_html(html):
+    """Extract a TaxAccountRecord from ViewPay page HTML in a single pass over the document."""
+    record = TaxAccountRecord()
+    root = lxml.html.fromstring(html)
+
+    for element in root.iter("input", "div"):
+        if element.tag == "input":
+            if element.get("id") == "sAccountNumber" and element.get("value"):
+                record.account_number = element.get("value")
+            continue
+        classes = _classes(element)
+        if "row" in classes:
+            _parse_row(element, record)
+        elif "validation-summary-errors" in classes and record.errors is None:
+            record.errors = [li.text_content() for li in element.iter("li")]
+
+    if record.total is not None:
+        record.tax_balance = parse_balance(record.total)
+    return record
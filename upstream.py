@@ -0,0 +1,244 @@
+import os
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+import metrics
+
+# Per-service limits: max in-flight requests and a token bucket (rate = tokens
+# per second, burst = bucket size). Override with e.g. GOOGLE_RATE=20,
+# NJPARCELS_CONCURRENCY=2 in the environment.
+# Services marked adaptive start at one request in flight and let
+# AdaptiveLimiter move between 1 and "concurrency" based on how the host responds.
+SERVICES = {
+    "google": {"host": "maps.googleapis.com", "concurrency": 10, "rate": 40.0, "burst": 40},
+    "njparcels": {"host": "njparcels.com", "concurrency": 4, "rate": 5.0, "burst": 5},
+    # Airtable allows 5 requests/sec per base and locks clients out for 30s beyond
+    # that, so stay safely under it in any one-second window
+    "airtable": {"host": "api.airtable.com", "concurrency": 5, "rate": 4.0, "burst": 1},
+    "taxsite": {"host": "taxes.cityofjerseycity.com", "concurrency": 8, "rate": 10.0, "burst": 2,
+                "adaptive": True},
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ServiceLimiter:
+    """Concurrency cap plus rate limit for a single upstream service."""
+
+    def __init__(self, name, concurrency, rate, burst):
+        self.name = name
+        self.concurrency = concurrency
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst)
+
+    @contextmanager
+    def slot(self):
+        with self.slots:
+            self.bucket.acquire()
+            yield
+
+    def observe(self, latency, failed=False, error=False):
+        """Report how a request went; only adaptive limiters use this.
+
+        failed means the host is overloaded (timeout, 429 or 5xx); error is any
+        other unsuccessful response.
+        """
+
+    def status(self):
+        return f"{self.name}: concurrency {self.concurrency}"
+
+
+class AdaptiveLimiter(ServiceLimiter):
+    """ServiceLimiter whose concurrency follows AIMD (additive increase, multiplicative decrease).
+
+    After every `window` healthy requests (p95 latency under target_p95 seconds and
+    error rate under max_error_rate) the limit grows by one, up to `concurrency`.
+    A timeout or 5xx response cuts it by `decrease`, down to one, at most once
+    per round trip: failures of requests sent before the last cut were sent at
+    the old limit, so they do not cut it again.
+    """
+
+    def __init__(self, name, concurrency, rate, burst, window=20, target_p95=5.0,
+                 max_error_rate=0.05, decrease=0.5):
+        super().__init__(name, concurrency, rate, burst)
+        self.limit = 1.0
+        self.window = window
+        self.target_p95 = target_p95
+        self.max_error_rate = max_error_rate
+        self.decrease = decrease
+        self.decreased_at = float("-inf")
+        self.in_flight = 0
+        self.latencies = []
+        self.errors = 0
+        self.recent = []
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+        try:
+            self.bucket.acquire()
+            yield
+        finally:
+            with self.cond:
+                self.in_flight -= 1
+                self.cond.notify_all()
+
+    def observe(self, latency, failed=False, error=False):
+        with self.cond:
+            self.recent = (self.recent + [latency])[-200:]
+            if failed:
+                now = time.monotonic()
+                if now - latency >= self.decreased_at:
+                    self.limit = max(1.0, self.limit * self.decrease)
+                    self.decreased_at = now
+                self.latencies = []
+                self.errors = 0
+                return
+            self.latencies.append(latency)
+            if error:
+                self.errors += 1
+            if len(self.latencies) >= self.window:
+                healthy = (percentile(self.latencies, 95) <= self.target_p95
+                           and self.errors / len(self.latencies) <= self.max_error_rate)
+                if healthy:
+                    self.limit = min(float(self.concurrency), self.limit + 1)
+                self.latencies = []
+                self.errors = 0
+            self.cond.notify_all()
+
+    def status(self):
+        with self.cond:
+            recent = list(self.recent)
+            limit = int(self.limit)
+            in_flight = self.in_flight
+        if not recent:
+            return f"{self.name}: concurrency {limit}, {in_flight} in flight"
+        return (f"{self.name}: concurrency {limit}, {in_flight} in flight, "
+                f"p50 {percentile(recent, 50):.2f}s, p95 {percentile(recent, 95):.2f}s")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_sessions = threading.local()
+
+
+def _setting(name, key, default):
+    value = os.getenv(f"{name.upper()}_{key.upper()}")
+    if value is None:
+        return default
+    return type(default)(value)
+
+
+def limiter(name):
+    """Return the shared ServiceLimiter (or AdaptiveLimiter) for a service in SERVICES."""
+    with _limiters_lock:
+        if name not in _limiters:
+            config = SERVICES[name]
+            cls = AdaptiveLimiter if config.get("adaptive") else ServiceLimiter
+            _limiters[name] = cls(
+                name,
+                _setting(name, "concurrency", config["concurrency"]),
+                _setting(name, "rate", config["rate"]),
+                _setting(name, "burst", config["burst"]),
+            )
+        return _limiters[name]
+
+
+def start_status_reporter(names, interval=10.0):
+    """Print the status of the named limiters every `interval` seconds until the returned event is set."""
+    stop = threading.Event()
+
+    def report():
+        while not stop.wait(interval):
+            print("[status] " + "; ".join(limiter(name).status() for name in names))
+
+    threading.Thread(target=report, daemon=True).start()
+    return stop
+
+
+def get_session():
+    """Return this thread's pooled requests.Session."""
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = requests.Session()
+        _sessions.session = session
+    return session
+
+
+def reset_session():
+    """Drop this thread's session, so the next request starts a new one."""
+    _sessions.session = None
+
+
+def request(service, method, url, session=None, **kwargs):
+    """Perform an HTTP request under the service's concurrency and rate limits.
+
+    Timeouts, connection errors, 429s and 5xx responses are reported to the
+    limiter as failures so adaptive services can back off.
+    """
+    session = session or get_session()
+    kwargs.setdefault("timeout", 30)
+    service_limiter = limiter(service)
+    with service_limiter.slot():
+        start = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            latency = time.monotonic() - start
+            metrics.registry.observe_request(service, method, latency, type(e).__name__, 0, 0)
+            service_limiter.observe(latency, failed=isinstance(e, (requests.Timeout, requests.ConnectionError)))
+            raise
+        latency = time.monotonic() - start
+        status = response.status_code
+        service_limiter.observe(latency, failed=status == 429 or status >= 500, error=400 <= status < 500)
+        metrics.registry.observe_request(service, method, latency, status,
+                                         len(response.request.body or b""), len(response.content))
+        return response
+
+
+def get(service, url, **kwargs):
+    return request(service, "GET", url, **kwargs)
+
+
+def post(service, url, **kwargs):
+    return request(service, "POST", url, **kwargs)
+
+
+def patch(service, url, **kwargs):
+    return request(service, "PATCH", url, **kwargs)